@@ -0,0 +1,371 @@
+"""
+Stage benchmarks for the content pipeline.
+
+Runs produce_gfx and produce_data of generate_content.py on the game and
+on synthetic projects with the locations, items, texts and scripts of the
+game copied 10 and 100 times, and times each stage: the reading and
+writing steps of generate_content.py and the conversions in gfxconvert
+and produce_regular_gfx. The times include the stages called from within
+a stage. The outputs go to a temporary directory, without the tile cache.
+
+Each copy of a location image has the pixel columns within its tiles
+shuffled, so that the copies add tiles of their own. The tile rows keep
+their colours, as the colour table holds only MAX_COLOUR_CODES entries,
+so merge_colour_codes works on the same colour codes at every scale.
+
+Saves the results as JSON, reports the stages whose time grows faster
+than the project and, given an earlier result file, compares the runs.
+"""
+import argparse
+import contextlib
+import functools
+import io
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import tempfile
+import time
+from configparser import ConfigParser
+
+import numpy as np
+from PIL import Image
+
+import generate_content
+import gfxconvert
+import produce_regular_gfx
+
+# The timed stages: (module, function name).
+STAGES = (
+    (generate_content, 'read_input'),
+    (generate_content, 'convert_location_images'),
+    (gfxconvert, 'convert_image'),
+    (generate_content, 'parse_location'),
+    (gfxconvert, 'merge_charset'),
+    (generate_content, 'parse_item'),
+    (generate_content, 'parse_scriptfile'),
+    (generate_content, 'optimize_scripts'),
+    (generate_content, 'eliminate_dead_content'),
+    (generate_content, 'merge_similar_tiles'),
+    (generate_content, 'order_tiles'),
+    (generate_content, 'prepare_graphics'),
+    (generate_content, 'write_palettes'),
+    (generate_content, 'write_tilegfx'),
+    (generate_content, 'merge_colour_codes'),
+    (generate_content, 'generate_huffdict'),
+    (generate_content, 'write_text_tokens'),
+    (generate_content, 'write_text_dictionaries'),
+    (generate_content, 'write_texts'),
+    (generate_content, 'write_direction_names'),
+    (generate_content, 'write_locations'),
+    (generate_content, 'write_script'),
+    (generate_content, 'write_item'),
+    (generate_content, 'write_constants'),
+    (generate_content, 'write_command_names'),
+    (generate_content, 'write_graphicsview'),
+    (generate_content, 'write_game_data'),
+    (produce_regular_gfx, 'convert_font'),
+    (produce_regular_gfx, 'convert_sprite'),
+    (produce_regular_gfx, 'convert_titlescreen'),
+    (produce_regular_gfx, 'convert_gamescreen'),
+)
+
+# The names in each kind of script command argument that are renamed in
+# the copies.
+SCRIPT_ARGUMENTS = {
+    "GOTO": ('locations',),
+    "SETITEMLOC": ('items', 'locations'),
+    "TEXT": ('texts',),
+    "IFTRUE": ('scripts',),
+    "ISLOC": ('locations',),
+    "GOEND": ('locations',),
+    "TEXTEND": ('texts',),
+    "TAKE": ('items',),
+    "TAKEEND": ('items',),
+    "ISOBJECT": ('items',),
+}
+
+# A stage is reported as growing too fast when its time grows by more
+# than the project size to this power, and it takes at least MIN_SECONDS.
+SUPERLINEAR_EXPONENT = 1.2
+MIN_SECONDS = 0.05
+
+
+def stage_name(module, fname):
+    if module is generate_content:
+        return fname
+    return "{}.{}".format(module.__name__, fname)
+
+
+@contextlib.contextmanager
+def timed_stages(stages):
+    """
+    Replace the stage functions with timed ones for the duration. Yields
+    a dict of the stage names to their total seconds and calls.
+    """
+    timings = {}
+    originals = []
+
+    def wrap(name, func):
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                entry = timings.setdefault(name, {'seconds': 0.0,
+                                                  'calls': 0})
+                entry['seconds'] += time.perf_counter() - t0
+                entry['calls'] += 1
+        return timed
+
+    for module, fname in stages:
+        func = getattr(module, fname)
+        originals.append((module, fname, func))
+        setattr(module, fname, wrap(stage_name(module, fname), func))
+    try:
+        yield timings
+    finally:
+        for module, fname, func in originals:
+            setattr(module, fname, func)
+
+
+def read_cfg(fname):
+    cfg = ConfigParser(interpolation=None)
+    cfg.optionxform = str
+    cfg.read(fname)
+    return cfg
+
+
+def copy_name(name, names, copy):
+    """
+    The name in the given copy, if it is one of names; names that are not,
+    like the special locations and the directions, stay as they are.
+    """
+    if copy == 0 or name.lower() not in names:
+        return name
+    return "{}_x{}".format(name, copy)
+
+
+def variant_image(fname, copy, out_dir):
+    """
+    Write a copy of the image with the pixel columns within each tile
+    shuffled, the same way for the whole image, so that it has tiles of
+    its own with the same colours on each tile row. Returns its name.
+    """
+    order = list(range(8))
+    rng = random.Random(copy)
+    while order == sorted(order):
+        rng.shuffle(order)
+    pixels = np.array(Image.open(fname))
+    columns = [x - x % 8 + order[x % 8] for x in range(pixels.shape[1])]
+    base = os.path.splitext(os.path.basename(fname))[0]
+    res = os.path.join(out_dir, "{}_x{}.png".format(base, copy))
+    Image.fromarray(pixels[:, columns]).save(res)
+    return res
+
+
+def synthetic_project(cfgfile, scale, out_dir):
+    """
+    Write a project with the content of cfgfile copied scale times into
+    out_dir, with its outputs there too. Returns the new config file and
+    the numbers of locations, items, texts and scripts.
+    """
+    src = read_cfg(cfgfile)
+    loc_head = generate_content.CFG_LOCATION_HEAD
+    item_head = generate_content.CFG_ITEM_HEAD
+    script_head = generate_content.CFG_SCRIPT_HEAD
+    names = {
+        'locations': set(s[len(loc_head):].lower() for s in src.sections()
+                         if s.startswith(loc_head)),
+        'items': set(s[len(item_head):].lower() for s in src.sections()
+                     if s.startswith(item_head)),
+        'texts': set(k.lower() for k in src['text']),
+    }
+    with open(src['in_files']['scripts'], "r") as f:
+        script_lines = f.read().splitlines()
+    names['scripts'] = set(line.split()[1][:-1].lower()
+                           for line in script_lines
+                           if line.strip().upper().startswith("SCRIPT"))
+
+    dst = ConfigParser(interpolation=None)
+    dst.optionxform = str
+    dst['text'] = {}
+    for copy in range(scale):
+        for k, v in src['text'].items():
+            dst['text'][copy_name(k, names['texts'], copy)] = v
+        for s in src.sections():
+            if s.startswith(loc_head):
+                kind, head = 'locations', loc_head
+            elif s.startswith(item_head):
+                kind, head = 'items', item_head
+            else:
+                continue
+            section = head + copy_name(s[len(head):], names[kind], copy)
+            dst[section] = {}
+            for k, v in src[s].items():
+                if k == 'gfx':
+                    v = os.path.abspath(v)
+                    if copy > 0:
+                        v = variant_image(v, copy, out_dir)
+                elif k in ('description', 'name'):
+                    v = copy_name(v, names['texts'], copy)
+                elif k == 'location':
+                    v = copy_name(v, names['locations'], copy)
+                elif k.startswith(script_head) or k.lower() == 'entrancescript':
+                    v = copy_name(v, names['scripts'], copy)
+                dst[section][k] = v
+
+    scripts_fname = os.path.join(out_dir, "scripts.script")
+    with open(scripts_fname, "w") as f:
+        for copy in range(scale):
+            for line in script_lines:
+                parts = line.split()
+                if not parts or parts[0].startswith(("#", ";")):
+                    continue
+                cmd = parts[0].upper()
+                if cmd.startswith("SCRIPT"):
+                    parts[1] = copy_name(parts[1][:-1], names['scripts'],
+                                         copy) + ":"
+                else:
+                    for i, kind in enumerate(SCRIPT_ARGUMENTS.get(cmd, ())):
+                        parts[i + 1] = copy_name(parts[i + 1], names[kind],
+                                                 copy)
+                f.write(" ".join(parts) + "\n")
+
+    dst['in_files'] = dict((k, os.path.abspath(v))
+                           for k, v in src['in_files'].items())
+    dst['in_files']['scripts'] = scripts_fname
+    dst['out_files'] = dict(
+        (k, os.path.join(out_dir, os.path.basename(v)))
+        for k, v in src['out_files'].items())
+    dst['options'] = dict(src['options'].items())
+    dst['options'].pop('tile_cache_dir', None)
+    dst['options']['workers'] = '1'
+
+    fname = os.path.join(out_dir, "project.cfg")
+    with open(fname, "w") as f:
+        dst.write(f)
+    sizes = dict((kind, len(v) * scale) for kind, v in names.items())
+    return fname, sizes
+
+
+def run_corpus(cfgfile, scale):
+    """
+    Run the pipeline on the project scaled scale times. Returns the stage
+    timings, the total time and the project sizes.
+    """
+    out_dir = tempfile.mkdtemp(prefix="jaassa_bench_")
+    try:
+        fname, sizes = synthetic_project(cfgfile, scale, out_dir)
+        with timed_stages(STAGES) as timings:
+            t0 = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                generate_content.produce_gfx(fname)
+                generate_content.produce_data(fname)
+            total = time.perf_counter() - t0
+    finally:
+        shutil.rmtree(out_dir)
+    return {'scale': scale, 'sizes': sizes, 'total_seconds': total,
+            'stages': timings}
+
+
+def growth(corpora):
+    """
+    For each stage, the exponent of its time against the project size
+    between the two largest corpora.
+    """
+    runs = sorted(corpora.values(), key=lambda c: c['scale'])
+    if len(runs) < 2:
+        return {}
+    a, b = runs[-2], runs[-1]
+    res = {}
+    for stage, entry in b['stages'].items():
+        before = a['stages'].get(stage)
+        if before is None or before['seconds'] <= 0:
+            continue
+        res[stage] = (math.log(entry['seconds'] / before['seconds']) /
+                      math.log(b['scale'] / a['scale']))
+    return res
+
+
+def report(results, previous=None):
+    corpora = results['corpora']
+    names = sorted(corpora, key=lambda n: corpora[n]['scale'])
+    print("{:40s}".format("Stage") +
+          "".join("{:>12s}".format(n) for n in names) +
+          "{:>9s}".format("growth"))
+    stages = [stage_name(module, fname) for module, fname in STAGES]
+    stages = [stage for stage in stages
+              if any(stage in corpora[n]['stages'] for n in names)]
+    for stage in stages:
+        row = "{:40s}".format(stage)
+        for n in names:
+            entry = corpora[n]['stages'].get(stage)
+            row += "{:>12s}".format(
+                "-" if entry is None else "{:.4f}".format(entry['seconds']))
+        g = results['growth'].get(stage)
+        row += "{:>9s}".format("" if g is None else "{:.2f}".format(g))
+        print(row)
+    print("{:40s}".format("total") + "".join(
+        "{:>12.4f}".format(corpora[n]['total_seconds']) for n in names))
+
+    largest = corpora[names[-1]]
+    for stage, g in sorted(results['growth'].items()):
+        if (g > SUPERLINEAR_EXPONENT and
+                largest['stages'][stage]['seconds'] >= MIN_SECONDS):
+            print("Grows faster than the project: {} (exponent {:.2f})"
+                  .format(stage, g))
+
+    if previous is not None:
+        print("Compared with the earlier run (new / old time):")
+        for n in names:
+            old = previous['corpora'].get(n)
+            if old is None:
+                continue
+            for stage, entry in corpora[n]['stages'].items():
+                old_entry = old['stages'].get(stage)
+                if old_entry is None or old_entry['seconds'] < MIN_SECONDS:
+                    continue
+                ratio = entry['seconds'] / old_entry['seconds']
+                if abs(ratio - 1) > 0.1:
+                    print("  {} {}: {:.2f}x".format(n, stage, ratio))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--cfg", default=os.path.join(
+        "..", "resources", "penguingamecontent.cfg"))
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100],
+                        help="How many copies of the game to run on.")
+    parser.add_argument("--output", default="benchmark.json",
+                        help="Where to save the results as JSON.")
+    parser.add_argument("--compare", default=None,
+                        help="Earlier results to compare against.")
+    args = parser.parse_args()
+
+    corpora = {}
+    for scale in args.scales:
+        name = "game" if scale == 1 else "x{}".format(scale)
+        print("Running on {}...".format(name))
+        corpora[name] = run_corpus(args.cfg, scale)
+    results = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'corpora': corpora,
+        'growth': growth(corpora),
+    }
+    previous = None
+    if args.compare:
+        with open(args.compare, "r") as f:
+            previous = json.load(f)
+    report(results, previous)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+    print("Results saved to", args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+import os
+import re
+
+# Binary backend for the game data.
+#
+# The data sections that generate_content.py writes as DB and DW lines
+# (locations, palettes, graphics views, texts, tiles, items and scripts)
+# are assembled here into one binary that main.asm INCBINs at a fixed
+# address, at the end of the ROM. The labels are resolved here as well,
+# so undefined and duplicate labels are reported before tniASM runs, and
+# the labels are written out as EQUs for the program code.
+#
+# This is a change on the assembler side: tniASM then only pads and
+# INCBINs the data instead of parsing its sources. The generator gets
+# slower, not faster, as the sources are still written and are read back
+# here and laid out twice, the first time to find the size.
+#
+# Only what the generator writes is understood: labels, DB and DW with
+# decimal and $hex numbers and symbols, and RB and RW for RAM. A writer
+# emitting anything else is an error here, and the directive must be
+# added to this module. As in tniASM, the case of the labels does not
+# matter; symbols are kept by their upper-case names.
+
+LINE_RE = re.compile(r"^\s*(?:([A-Za-z_][\w.]*):)?\s*(?:(\w+)\s*(.*))?$")
+EQU_RE = re.compile(r"^\s*([A-Za-z_]\w*):?\s+EQU\s+(\$[0-9a-fA-F]+|\d+)\s*$",
+                    re.IGNORECASE)
+ORG_RE = re.compile(r"^\s*org\s+(\$[0-9a-fA-F]+|\d+)\s*$", re.IGNORECASE)
+INCLUDE_RE = re.compile(r'^\s*include\s+"([^"]+)"', re.IGNORECASE)
+
+SIZES = {'DB': 1, 'DW': 2}
+RESERVE_SIZES = {'RB': 1, 'RW': 2}
+
+
+def parse_number(s):
+    if s.startswith("$"):
+        return int(s[1:], 16)
+    return int(s)
+
+
+def read_main_source(fname, ram_include):
+    """
+    Read the numeric EQUs of the main source and the org address where
+    ram_include, the file name as in its INCLUDE line, is included.
+    """
+    equates = {}
+    org = None
+    ram_org = None
+    with open(fname, "r") as f:
+        for line in f:
+            line = line.split(";")[0]
+            m = EQU_RE.match(line)
+            if m:
+                equates[m.group(1).upper()] = parse_number(m.group(2))
+                continue
+            m = ORG_RE.match(line)
+            if m:
+                org = parse_number(m.group(1))
+                continue
+            m = INCLUDE_RE.match(line)
+            if m and m.group(1) == ram_include:
+                ram_org = org
+    if ram_org is None:
+        raise ValueError("{} does not include {} after an org".format(
+            fname, ram_include))
+    return equates, ram_org
+
+
+def parse_lines(fname):
+    """
+    Yield the line number, label, directive and operands of each line.
+    """
+    with open(fname, "r") as f:
+        for n, line in enumerate(f, 1):
+            line = line.split(";")[0].rstrip()
+            m = LINE_RE.match(line)
+            if m is None:
+                raise ValueError("{}:{}: cannot parse '{}'".format(
+                    fname, n, line.strip()))
+            label, directive, rest = m.groups()
+            operands = []
+            if directive is not None:
+                directive = directive.upper()
+                operands = [o.strip() for o in rest.split(",") if o.strip()]
+            yield n, label, directive, operands
+
+
+def layout(sections, address, symbols, reserve=False, names=None):
+    """
+    Give every label in the sections its address, starting at address.
+    sections is a list of (label, file name) pairs; the label, if any,
+    marks the start of the section. With reserve, the sections may only
+    reserve RAM. names, if given, gets the spelling of each label.
+    Returns the address after the sections.
+    """
+    allowed = RESERVE_SIZES if reserve else SIZES
+
+    def define(label, where):
+        key = label.upper()
+        if key in symbols:
+            raise ValueError("{}: label {} defined twice".format(
+                where, label))
+        symbols[key] = address
+        if names is not None:
+            names[key] = label
+
+    for section_label, fname in sections:
+        if section_label is not None:
+            define(section_label, fname)
+        for n, label, directive, operands in parse_lines(fname):
+            if label is not None:
+                define(label, "{}:{}".format(fname, n))
+            if directive is None:
+                continue
+            if directive not in allowed:
+                raise ValueError("{}:{}: {} is not supported by the binary "
+                                 "data backend".format(fname, n, directive))
+            if reserve:
+                address += allowed[directive] * sum(
+                    parse_number(o) for o in operands)
+            else:
+                address += allowed[directive] * len(operands)
+    return address
+
+
+def assemble(sections, symbols):
+    """
+    Assemble the sections, with the labels already laid out in symbols.
+    """
+    output = bytearray()
+    for _, fname in sections:
+        for n, _, directive, operands in parse_lines(fname):
+            if directive is None:
+                continue
+            size = SIZES[directive]
+            for o in operands:
+                if o[0].isdigit() or o[0] == "$":
+                    value = parse_number(o)
+                elif o.upper() in symbols:
+                    value = symbols[o.upper()]
+                else:
+                    raise ValueError("{}:{}: undefined label {}".format(
+                        fname, n, o))
+                if not 0 <= value < 1 << (8 * size):
+                    raise ValueError("{}:{}: {} out of range for {}".format(
+                        fname, n, o, directive))
+                output.extend(value.to_bytes(size, "little"))
+    return output
+
+
+def build(sections, ram_sections, main_source, data_end):
+    """
+    Assemble the ROM sections so that they end at data_end. They may refer
+    to the EQUs of main_source and to the labels of the RAM sections, given
+    as (file name, name in its INCLUDE line) pairs.
+
+    Returns the binary, its address and the labels of the ROM sections.
+    """
+    symbols = {}
+    for fname, include_name in ram_sections:
+        equates, ram_org = read_main_source(main_source, include_name)
+        layout([(None, fname)], ram_org, symbols, reserve=True)
+        symbols.update(equates)
+    external = set(symbols)
+
+    size = layout(sections, 0, dict(symbols))
+    base = data_end - size
+    names = {}
+    layout(sections, base, symbols, names=names)
+    data = assemble(sections, symbols)
+    labels = dict((names[k], v) for k, v in symbols.items()
+                  if k not in external)
+    return data, base, labels
+
+
+def write_data_include(f, binary_fname, base, labels):
+    """
+    Write the source that main.asm includes for the binary: the padding up
+    to its address, the INCBIN and the EQUs of its labels.
+    """
+    f.write(";; Game data, assembled by the content generator.\n")
+    f.write("\t\tDS ${:04x} - $ ;; Fails if the program is too large.\n"
+            .format(base))
+    f.write('\t\tINCBIN "{}"\n\n'.format(binary_fname))
+    for label, address in sorted(labels.items(), key=lambda kv: kv[1]):
+        f.write("{}: EQU ${:04x}\n".format(label, address))
+
+
+def source_path(fname, source_dir):
+    """
+    The path of fname as tniASM sees it, run in source_dir.
+    """
+    return os.path.relpath(fname, source_dir).replace(os.sep, "/")
@@ -0,0 +1,109 @@
+import hashlib
+import io
+import json
+import os
+from contextlib import contextmanager
+
+# Incremental builds.
+#
+# A build step is skipped when the hash of its inputs matches the one
+# recorded in the manifest and its outputs still have the recorded
+# content. Outputs are only written when their content changes, so the
+# files of a skipped or unchanged step keep their modification times.
+
+
+def file_hash(fname):
+    """
+    Return the SHA-256 of the file, or None if it does not exist.
+    """
+    try:
+        with open(fname, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+def inputs_hash(files=(), values=()):
+    """
+    Hash the contents of the files and the repr of the values together.
+    """
+    h = hashlib.sha256()
+    for fname in files:
+        h.update(fname.encode("utf-8"))
+        h.update(str(file_hash(fname)).encode("utf-8"))
+    for v in values:
+        h.update(repr(v).encode("utf-8"))
+    return h.hexdigest()
+
+
+@contextmanager
+def open_output(fname, mode="w"):
+    """
+    Like open(fname, mode) for writing, but leave the file untouched if
+    the content written is the same as the file has.
+    """
+    binary = "b" in mode
+    buf = io.BytesIO() if binary else io.StringIO()
+    yield buf
+    content = buf.getvalue()
+    if not binary:
+        content = content.encode("utf-8")
+    try:
+        with open(fname, "rb") as f:
+            if f.read() == content:
+                return
+    except FileNotFoundError:
+        pass
+    with open(fname, "wb") as f:
+        f.write(content)
+
+
+class Manifest(object):
+    """
+    The input hash and output hashes of each build step, kept in a JSON
+    file between runs.
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.steps = {}
+        if os.path.exists(fname):
+            with open(fname, "r") as f:
+                self.steps = json.load(f).get("steps", {})
+
+    def is_current(self, step, inputs, outputs):
+        """
+        True if the step was last run with the same inputs and its
+        outputs are unchanged since.
+        """
+        record = self.steps.get(step)
+        if record is None or record["inputs"] != inputs:
+            return False
+        if sorted(record["outputs"]) != sorted(outputs):
+            return False
+        return all(file_hash(fname) == h
+                   for fname, h in record["outputs"].items())
+
+    def record(self, step, inputs, outputs, values=None):
+        """
+        Record the step as run. values, if given, are kept with it for
+        the runs that skip the step; see values().
+        """
+        self.steps[step] = {
+            "inputs": inputs,
+            "outputs": dict((fname, file_hash(fname)) for fname in outputs),
+        }
+        if values is not None:
+            self.steps[step]["values"] = values
+
+    def values(self, step):
+        """
+        The values recorded with the step, or an empty dict.
+        """
+        return self.steps.get(step, {}).get("values", {})
+
+    def save(self):
+        tmpname = self.fname + ".tmp"
+        with open(tmpname, "w") as f:
+            json.dump({"steps": self.steps}, f, indent=1, sort_keys=True)
+        os.replace(tmpname, self.fname)
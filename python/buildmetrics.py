@@ -0,0 +1,73 @@
+import json
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Metrics of a content build.
+#
+# Each stage of produce_data() records its wall time and, when memory
+# tracing is on, the peak of the memory allocated by Python during the
+# stage, above what was allocated when it started. The stages count what
+# they produce, such as the tiles and the compressed text bytes, into
+# named counters. The whole is written as a JSON report.
+#
+# Tracing the memory with tracemalloc slows the build down several times,
+# so it is only done when a report is written.
+
+
+class Metrics(object):
+    """
+    The timings of the build stages and the counters, in the order
+    recorded.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stages = OrderedDict()
+        self.counters = OrderedDict()
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time the code run in the with block as the stage name. Stages
+        should not be nested, as tracemalloc has only one peak.
+        """
+        started = False
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started = True
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            entry = self.stages.setdefault(name, {'seconds': 0.0})
+            entry['seconds'] += time.perf_counter() - t0
+            if self.trace_memory:
+                peak = tracemalloc.get_traced_memory()[1] - base
+                entry['peak_bytes'] = max(entry.get('peak_bytes', 0), peak)
+                if started:
+                    tracemalloc.stop()
+
+    def skip(self, name):
+        """
+        Record the stage as skipped, its outputs being up to date.
+        """
+        self.stages[name] = {'seconds': 0.0, 'skipped': True}
+
+    def count(self, name, value):
+        self.counters[name] = value
+
+    def report(self):
+        return {
+            'total_seconds': sum(s['seconds'] for s in self.stages.values()),
+            'stages': self.stages,
+            'counters': self.counters,
+        }
+
+    def save(self, fname):
+        with open(fname, "w") as f:
+            json.dump(self.report(), f, indent=1)
@@ -0,0 +1,171 @@
+"""
+Cycle-cost model of the text decoding in src/main.asm.
+
+Counts the Z80 T-states that GetTextToBuffer spends in
+SelectTextDictionary, Decompress and DecodeText_HL2DE for a string, from
+the instruction timings of those routines. ClearTextbox and the VRAM
+transfer are not included.
+"""
+
+# MSX Z80 clock and the T-states in a 60 Hz frame.
+CLOCK_HZ = 3579545
+FRAME_T_STATES = CLOCK_HZ // 60
+
+# The text window is 30 x 6 characters.
+SCREEN_CHARACTERS = 30 * 6
+
+CODE_TERMINATOR = 0
+CODE_UPPERCASE = 1
+CODE_NEWLINE = 2
+
+# Decompress.
+# Call, then read the end byte, push the root and load the first byte.
+DECOMPRESS_SETUP = 17 + 19 + 13 + 10 + 15 + 10 + 7 + 19 + 7
+# .cycleBits: ld a, (ix); bit 0, c; jp z.
+BIT_READ = 19 + 8 + 10
+# .isOne: ld a, (ix + 1); jp.
+BIT_ONE = 19 + 10
+# .checkIfEnd: step to the child and test for a leaf.
+BIT_STEP = 7 + 4 + 15 + 19 + 7 + 10
+# jp .nextBit after an internal node.
+INTERNAL_NODE = 10
+# .wasLeaf for a symbol: compare to the end byte, store it, back to root.
+LEAF_NODE = 13 + 19 + 4 + 10 + 7 + 6 + 7 + 14 + 15 + 10
+# .wasLeaf for the end token and .endDecomp.
+END_NODE = 13 + 19 + 4 + 10 + 14 + 10
+# .nextBit: sra c; djnz taken.
+NEXT_BIT = 8 + 13
+# Extra for moving to the next byte: djnz not taken, inc iy, jp,
+# ld c, (iy); ld b, 8.
+NEXT_BYTE = 8 + 10 + 10 + 19 + 7 - 13
+
+# DecodeText_HL2DE.
+# ld c, 0 and ld b, 0 at the entry.
+DECODE_ENTRY = 7 + 7
+# ld b, 0 at .expand, where the token expansions are decoded.
+DECODE_EXPAND = 7
+# A character: the tests for the control codes, then the write.
+DECODE_CHARACTER = (7 + 6 + 7 + 10 + 7 + 5 + 7 + 10 + 7 + 10 +
+                    4 + 7 + 7 + 6 + 4 + 10)
+# The newline: the tests, then the skip to the next line.
+DECODE_NEWLINE = (7 + 6 + 7 + 10 + 7 + 5 + 7 + 10 +
+                  7 + 4 + 4 + 4 + 4 + 4 + 4 + 7 + 10)
+# The uppercase marker.
+DECODE_UPPERCASE = 7 + 6 + 7 + 10 + 7 + 10
+# The terminator, returning.
+DECODE_TERMINATOR = 7 + 6 + 7 + 10 + 7 + 11
+# A token: the tests, the table lookup with UnrefHL, the call and the
+# return to the loop, keeping the column. The expansion is counted
+# separately.
+DECODE_TOKEN = (7 + 6 + 7 + 10 + 7 + 5 + 7 + 10 + 7 + 10 +
+                11 + 11 + 7 + 4 + 7 + 11 + 10 + 11 +
+                17 + 11 + 7 + 6 + 7 + 4 + 10 + 10 +
+                10 + 11 + 17 + 4 + 10 + 4 + 10 + 10)
+
+# UnrefHL with its call.
+UNREF_HL = 17 + 11 + 7 + 6 + 7 + 4 + 10 + 10
+
+# SelectTextDictionary with its call, with one or several dictionaries.
+SELECT_SINGLE = 17 + 14 + 7 + 7 + 11
+SELECT_MULTIPLE = (17 + 14 + 7 + 7 + 5 + 19 + 10 + 4 + 4 + 7 + 10 + 11 +
+                   UNREF_HL + 11 + 14 + 10)
+
+# GetTextToBuffer itself: its call and return, the buffer pointers and
+# the call to DecodeText_HL2DE.
+GET_TEXT = 17 + 10 + 10 + 10 + 17 + 10
+
+
+def code_cycles(dictionary):
+    """
+    T-states Decompress spends on the code of each symbol, without the
+    moves to the next byte.
+    """
+    end_token = dictionary['end_token']
+    cycles = {}
+    for c, bitstring in dictionary['char2bitstring'].items():
+        n = len(bitstring)
+        t = (BIT_READ + BIT_STEP) * n + BIT_ONE * bitstring.count("1")
+        t += INTERNAL_NODE * (n - 1) + NEXT_BIT * (n - 1)
+        if c == end_token:
+            t += END_NODE
+        else:
+            t += LEAF_NODE + NEXT_BIT
+        cycles[c] = t
+    return cycles
+
+
+def decompress_cycles(dictionary, symbols, cycles=None):
+    """
+    T-states for Decompress to unpack the symbols and reach the end token.
+    """
+    if cycles is None:
+        cycles = code_cycles(dictionary)
+    lengths = dictionary['code_table']
+    end_token = dictionary['end_token']
+    t = DECOMPRESS_SETUP + cycles[end_token]
+    n_bits = lengths[end_token][1]
+    for c in symbols:
+        t += cycles[c]
+        n_bits += lengths[c][1]
+    return t + NEXT_BYTE * ((n_bits - 1) // 8)
+
+
+def display_cycles(symbols, tokens=None, entry=DECODE_ENTRY):
+    """
+    T-states for DecodeText_HL2DE to write the decoded symbols, and the
+    number of characters written. tokens maps the token codes to their
+    expansions.
+    """
+    t = entry
+    n_chars = 0
+    for c in symbols:
+        if c == CODE_TERMINATOR:
+            return t + DECODE_TERMINATOR, n_chars
+        elif c == CODE_UPPERCASE:
+            t += DECODE_UPPERCASE
+        elif c == CODE_NEWLINE:
+            t += DECODE_NEWLINE
+        elif tokens and c in tokens:
+            expanded, n = display_cycles(tokens[c], entry=DECODE_EXPAND)
+            t += DECODE_TOKEN + expanded + DECODE_TERMINATOR
+            n_chars += n
+        else:
+            t += DECODE_CHARACTER
+            n_chars += 1
+    return t, n_chars
+
+
+def text_cycles(dictionary, symbols, tokens=None, n_dictionaries=1,
+                cycles=None):
+    """
+    T-states for GetTextToBuffer to decode the symbols, and the number of
+    characters written.
+    """
+    t = SELECT_SINGLE if n_dictionaries == 1 else SELECT_MULTIPLE
+    t += GET_TEXT + decompress_cycles(dictionary, symbols, cycles)
+    shown, n_chars = display_cycles(symbols, tokens)
+    return t + shown, n_chars
+
+
+def summarize(string_cycles, n_chars):
+    """
+    Summarize the T-states of each string and the characters they show.
+    """
+    total = sum(string_cycles)
+    per_char = total / max(n_chars, 1)
+    return {
+        'strings': len(string_cycles),
+        'total': total,
+        'average': total / max(len(string_cycles), 1),
+        'longest': max(string_cycles) if string_cycles else 0,
+        'per_character': per_char,
+        'per_screen': per_char * SCREEN_CHARACTERS,
+    }
+
+
+def as_milliseconds(t_states):
+    return 1000.0 * t_states / CLOCK_HZ
+
+
+def as_frames(t_states):
+    return t_states / FRAME_T_STATES
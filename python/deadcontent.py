@@ -0,0 +1,132 @@
+import os
+import re
+
+import scriptopt
+
+# Elimination of the content the game can never reach.
+#
+# Starting from the labels the program code refers to, such as the start
+# location in GameInit, the pass follows the references between the
+# content: a location leads to its description, its direction and
+# entrance scripts and the items that start there, an item to its name
+# and scripts, and a script to the locations, items, texts and scripts
+# its commands name. Whatever is not reached is never shown or run.
+#
+# As in tniASM, the case of the names does not matter.
+
+KINDS = ('locations', 'items', 'scripts', 'texts')
+
+
+def source_references(source_dir, templates):
+    """
+    The names of each kind that the assembly sources in source_dir refer
+    to. templates maps the kinds to their label templates, like "__S_{}".
+    """
+    patterns = dict(
+        (kind, re.compile(re.escape(template.split("{}")[0]) + r"(\w+)"))
+        for kind, template in templates.items())
+    refs = dict((kind, set()) for kind in templates)
+    for fname in sorted(os.listdir(source_dir)):
+        if not fname.endswith(".asm"):
+            continue
+        with open(os.path.join(source_dir, fname), "r") as f:
+            source = f.read()
+        for kind, pattern in patterns.items():
+            refs[kind].update(pattern.findall(source))
+    return refs
+
+
+def command_references(cmd):
+    """
+    The (kind, name) pairs a script command refers to.
+    """
+    code = cmd[0]
+    if code in (scriptopt.GOTO, scriptopt.GOEND, scriptopt.ISLOC):
+        return [('locations', cmd[1])]
+    if code == scriptopt.SETITEMLOC:
+        return [('items', cmd[1]), ('locations', cmd[2])]
+    if code in (scriptopt.TEXT, scriptopt.TEXTEND):
+        return [('texts', cmd[1])]
+    if code == scriptopt.IFTRUE:
+        return [('scripts', cmd[1])]
+    if code in (scriptopt.TAKE, scriptopt.TAKEEND, scriptopt.ISOBJECT):
+        # ISOBJECT may name a direction instead, which is not found.
+        return [('items', cmd[1])]
+    return []
+
+
+def reachable(data, roots):
+    """
+    The names of each kind reachable from roots, a dict of the kinds to
+    names. data has the parsed 'locations', 'items', 'scripts' and
+    'texts'; names not found there, like the special locations, are
+    skipped.
+    """
+    lookup = dict((kind, dict((name.lower(), name) for name in data[kind]))
+                  for kind in KINDS)
+    aliases = data.get('script_aliases', {})
+    items_at = {}
+    for item, item_d in data['items'].items():
+        items_at.setdefault(item_d['location'].lower(), []).append(item)
+
+    seen = dict((kind, set()) for kind in KINDS)
+    todo = []
+
+    def visit(kind, name):
+        if kind == 'scripts':
+            name = aliases.get(name, name)
+        name = lookup[kind].get(name.lower())
+        if name is not None and name not in seen[kind]:
+            seen[kind].add(name)
+            todo.append((kind, name))
+
+    for kind, names in roots.items():
+        for name in names:
+            visit(kind, name)
+
+    while todo:
+        kind, name = todo.pop()
+        if kind == 'locations':
+            loc = data['locations'][name]
+            visit('texts', loc['description'])
+            for cmds in loc['scripts'].values():
+                for script in cmds.values():
+                    visit('scripts', script)
+            if 'entrancescript' in loc:
+                visit('scripts', loc['entrancescript'])
+            for item in items_at.get(name.lower(), []):
+                visit('items', item)
+        elif kind == 'items':
+            item_d = data['items'][name]
+            visit('texts', item_d['name'])
+            for script in item_d['scripts'].values():
+                visit('scripts', script)
+        elif kind == 'scripts':
+            for cmd in data['scripts'][name]:
+                for ref_kind, ref in command_references(cmd):
+                    visit(ref_kind, ref)
+    return seen
+
+
+def drop_unused_tiles(defined_chars, location_gfx):
+    """
+    Drop the tiles no location uses from defined_chars and renumber the
+    rest, in their old order, in place. Returns the number dropped.
+    """
+    used = set()
+    for gfx in location_gfx.values():
+        used.update(gfx.values())
+    remap = {}
+    for t in sorted(defined_chars.values()):
+        if t in used:
+            remap[t] = len(remap)
+    n_dropped = len(defined_chars) - len(remap)
+    for k in list(defined_chars):
+        if defined_chars[k] in remap:
+            defined_chars[k] = remap[defined_chars[k]]
+        else:
+            del defined_chars[k]
+    for gfx in location_gfx.values():
+        for pos in gfx:
+            gfx[pos] = remap[gfx[pos]]
+    return n_dropped
@@ -0,0 +1,224 @@
+"""
+Explorer and solver for the game scripts.
+
+Plays every command the player can choose, on every hotspot of every
+state reached, with the script interpreter in scriptvm.py. The states
+(player location, item locations and GAME_STATE) are hashed, so each is
+expanded once. Reports the shortest way to the ending location, the
+states from which the ending can no longer be reached, the content never
+reached and how much of each script ran.
+"""
+import argparse
+import contextlib
+import io
+import os
+import time
+from collections import deque
+from configparser import ConfigParser
+
+import deadcontent
+import generate_content
+import scriptvm
+
+# The game is won on reaching this location.
+ENDING_LOCATION = "Ending"
+
+COMMAND_NAMES = dict((v, k)
+                     for k, v in generate_content.PLAYER_COMMANDS.items())
+
+
+def actions(machine, state):
+    """
+    The (hotspot, command, target) actions the player can choose.
+    """
+    hotspots = machine.hotspots(state)
+    for hotspot in hotspots:
+        for command in sorted(machine.commands(state, hotspot)):
+            if command == scriptvm.CMD_USE:
+                for target in hotspots:
+                    yield hotspot, command, target
+            else:
+                yield hotspot, command, None
+
+
+def explore(machine, ending=ENDING_LOCATION, max_states=None):
+    """
+    Breadth-first search of the game states from a new game. The ending
+    states are not expanded. Returns a dict with:
+    - 'parents': state key -> (parent key, action), None for the start,
+    - 'successors': state key -> set of the keys reached from it,
+    - 'wins': the keys of the states at the ending, in the order found,
+    - 'states': state key -> state, and 'complete', False if max_states
+      stopped the search.
+    The commands run are recorded in machine.coverage.
+    """
+    machine.coverage = {}
+    start = machine.new_game(log_texts=False)
+    start_key = start.key()
+    parents = {start_key: None}
+    successors = {}
+    states = {start_key: start}
+    wins = []
+    queue = deque([start_key])
+    complete = True
+    while queue:
+        key = queue.popleft()
+        state = states[key]
+        if state.location == ending:
+            wins.append(key)
+            continue
+        succ = successors[key] = set()
+        for action in actions(machine, state):
+            new = state.copy()
+            machine.act(new, *action)
+            new_key = new.key()
+            succ.add(new_key)
+            if new_key in parents:
+                continue
+            if max_states is not None and len(parents) >= max_states:
+                complete = False
+                continue
+            parents[new_key] = (key, action)
+            states[new_key] = new
+            queue.append(new_key)
+    return {'parents': parents, 'successors': successors, 'wins': wins,
+            'states': states, 'complete': complete}
+
+
+def path_to(parents, key):
+    """
+    The actions from the start to the state.
+    """
+    path = []
+    while parents[key] is not None:
+        key, action = parents[key]
+        path.append(action)
+    path.reverse()
+    return path
+
+
+def dead_ends(result):
+    """
+    The keys of the explored states from which no ending state is reached.
+    """
+    predecessors = {}
+    for key, succ in result['successors'].items():
+        for s in succ:
+            predecessors.setdefault(s, set()).add(key)
+    alive = set(result['wins'])
+    todo = list(alive)
+    while todo:
+        key = todo.pop()
+        for p in predecessors.get(key, ()):
+            if p not in alive:
+                alive.add(p)
+                todo.append(p)
+    return [key for key in result['parents'] if key not in alive]
+
+
+def unreached(machine, data, result, shown=()):
+    """
+    The locations, items, scripts and texts never reached in the explored
+    states, as sorted lists in a dict. shown are the texts the program
+    code shows itself.
+    """
+    coverage = machine.coverage
+    locations = set()
+    items = set()
+    for state in result['states'].values():
+        locations.add(state.location)
+        for kind, name in machine.hotspots(state):
+            if kind == scriptvm.ITEM:
+                items.add(name)
+    texts = set(data['locations'][loc]['description'] for loc in locations)
+    texts.update(data['items'][item]['name'] for item in items)
+    texts.update(shown)
+    for script, indices in coverage.items():
+        for i in indices:
+            cmd = machine.scripts[script][i]
+            if cmd[0] in (scriptvm.TEXT, scriptvm.TEXTEND):
+                texts.add(cmd[1])
+    return {
+        'locations': sorted(set(data['locations']) - locations),
+        'items': sorted(set(data['items']) - items),
+        'scripts': sorted(set(machine.scripts) - set(coverage)),
+        'texts': sorted(set(data['texts']) - texts),
+    }
+
+
+def describe(action):
+    hotspot, command, target = action
+    res = "{} {}".format(COMMAND_NAMES[command], hotspot[1])
+    if target is not None:
+        res += " on {}".format(target[1])
+    return res
+
+
+def report(machine, data, result, elapsed, shown=()):
+    print("Explored {} states in {:.2f} s{}".format(
+        len(result['parents']), elapsed,
+        "" if result['complete'] else ", stopped at the state limit"))
+
+    if result['wins']:
+        path = path_to(result['parents'], result['wins'][0])
+        print("Shortest solution, {} actions:".format(len(path)))
+        for i, action in enumerate(path, 1):
+            print("  {:3d}. {}".format(i, describe(action)))
+    else:
+        print("No solution found.")
+
+    if result['complete']:
+        dead = dead_ends(result)
+        print("Dead-end states, from which the ending cannot be reached: {}"
+              .format(len(dead)))
+        if dead:
+            # The states are found in breadth-first order.
+            path = path_to(result['parents'], dead[0])
+            print("  Nearest: " + ", ".join(describe(a) for a in path))
+    else:
+        print("Dead-end states: not known, the search is incomplete")
+
+    for kind, names in unreached(machine, data, result, shown).items():
+        print("Never reached {}: {}".format(
+            kind, ", ".join(names) if names else "none"))
+
+    print("Script coverage, commands run:")
+    n_run = n_all = 0
+    for script in sorted(machine.scripts):
+        n = len(machine.scripts[script])
+        run = len(machine.coverage.get(script, ()))
+        n_run += run
+        n_all += n
+        if run < n:
+            print("  {}: {}/{}".format(script, run, n))
+    print("  In all: {}/{} commands, {:.1f}%".format(
+        n_run, n_all, 100.0 * n_run / n_all))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--cfg", default=os.path.join(
+        "..", "resources", "penguingamecontent.cfg"))
+    parser.add_argument("--ending", default=ENDING_LOCATION)
+    parser.add_argument("--start", default=scriptvm.START_LOCATION)
+    parser.add_argument("--max-states", type=int, default=None)
+    args = parser.parse_args()
+
+    cfg = ConfigParser()
+    cfg.optionxform = str
+    cfg.read(args.cfg)
+    shown = deadcontent.source_references(
+        os.path.dirname(cfg['in_files']['main_source']),
+        {'texts': generate_content.LABELTEMPLATE_TEXT})['texts']
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        data = scriptvm.read_game(args.cfg)
+    machine = scriptvm.ScriptMachine(data, args.start)
+    t0 = time.perf_counter()
+    result = explore(machine, machine.resolve('locations', args.ending),
+                     args.max_states)
+    report(machine, data, result, time.perf_counter() - t0, shown)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,23 @@
+import argparse
+import functools
 import os
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
+import binarybackend
+import buildmanifest
+import buildmetrics
+import cyclemodel
+import deadcontent
 import gfxconvert
 import huffmanencoder
 import produce_regular_gfx
+import screencodecs
+import scriptopt
+import texttokens
+import tilecache
+import tilemerge
+import tileorder
 
 """
 TODO:
@@ -104,20 +118,34 @@ INV_LOCATION = "INVENTORY"
 
 LINE_LENGTH = 32 - 2
 
+# What the text compression options are chosen to minimise.
+TEXT_OBJECTIVES = ('size', 'cycles')
 
-def wordwrap_text(s):
+# How the wrapped lines are ended: padded with spaces to LINE_LENGTH, or
+# with a newline code that moves the decoder to the next line.
+TEXT_WRAPS = ('pad', 'newline')
+
+
+def wordwrap_text(s, wrap='pad'):
     """
-    Apply very simple wordwrap -- add extra spaces at the end of the lines.
-    Wastes space, but was simple to implement.
+    Apply very simple wordwrap -- add extra spaces at the end of the lines,
+    or with wrap='newline', a newline after each line. The newline is
+    written after full lines too, as it is what resets the column count
+    of DecodeText_HL2DE.
     """
     res = []
 
     row = ""
     for v in s.split():
+        if wrap == 'newline' and len(v) > LINE_LENGTH:
+            raise ValueError("word longer than a line: {}".format(v))
         rowlen = len(row) + len(v) + 1
         if rowlen > LINE_LENGTH:
-            pad = LINE_LENGTH - len(row)
-            res.append(row + " " * pad)
+            if wrap == 'newline':
+                res.append(row + "\\")
+            else:
+                pad = LINE_LENGTH - len(row)
+                res.append(row + " " * pad)
             row = v
         else:
             if len(row) >= 1:
@@ -128,12 +156,12 @@ def wordwrap_text(s):
     return "".join(res)
 
 
-def encode_text(s):
+def encode_text(s, wrap='pad'):
     """
     Convert a string to a sequence of characters
     to pack.
     """
-    s = wordwrap_text(s)
+    s = wordwrap_text(s, wrap)
     res = []
     for c in s:
         if c == "\\":
@@ -148,18 +176,29 @@ def encode_text(s):
     return bytes(res)
 
 
+def encode_display_text(data, s):
+    """
+    Encode a string as it is stored in the game: encode_text() followed
+    by the token substitution, if tokens are in use.
+    """
+    v = encode_text(s, data.get('text_wrap', 'pad'))
+    if data.get('text_tokens'):
+        v = texttokens.tokenize(v, data['text_tokens'])
+    return v
+
+
 def write_direction_names(data, fname):
     """
     Write the compressed strings for each direction into a file ready for
     inclusion in the ASM source code.
     """
-    with open(fname, 'w') as f:
+    with buildmanifest.open_output(fname) as f:
         f.write(";; Direction names.\n")
         dnames = []
         for k, v in sorted([(b, a) for (a, b) in DIRECTION_VALUES.items()]):
             lbl = "__DIRNAME_{}".format(v)
             dnames.append(lbl)
-            enc = encode_text(v)
+            enc = encode_display_text(data, v)
             f.write("{}:\n".format(lbl))
             write_compressed_string(data, f, enc, v)
         f.write("DIRECTION_NAMES:\n")
@@ -171,7 +210,7 @@ def write_command_names(data, fname):
     Write the compressed strings for each direction into a file ready for
     inclusion in the ASM source code.
     """
-    with open(fname, 'w') as f:
+    with buildmanifest.open_output(fname) as f:
         f.write(";; Command names.\n")
         dnames = []
         for k, v in sorted([(b, a) for (a, b) in PLAYER_COMMANDS.items()]):
@@ -179,7 +218,7 @@ def write_command_names(data, fname):
 
             lbl = "__CMDNAME_{}".format(lbl1)
             dnames.append(lbl)
-            enc = encode_text(v)
+            enc = encode_display_text(data, v)
             f.write("{}:\n".format(lbl))
             write_compressed_string(data, f, enc, v)
         f.write("COMMAND_NAMES:\n")
@@ -190,13 +229,21 @@ def write_texts(cfg, data, fname):
     """
     Writes the items under [text] section.
     """
-    d = cfg['text']
-    with open(fname, 'w') as f:
+    d = data['texts']
+    sizes = OrderedDict()
+    with buildmanifest.open_output(fname) as f:
         f.write(";; Strings compressed \n")
         for k, v_orig in d.items():
-            v = encode_text(v_orig)
+            v = encode_display_text(data, v_orig)
+            cp = compress_text(data, v)
+            sizes[k] = {'raw': len(v_orig), 'compressed': len(cp)}
             f.write("{}: ;;\n".format(LABELTEMPLATE_TEXT.format(k)))
-            write_compressed_string(data, f, v, v_orig)
+            write_compressed_string(data, f, v, v_orig, cp)
+    metrics = data['metrics']
+    metrics.count('text_bytes_raw', sum(s['raw'] for s in sizes.values()))
+    metrics.count('text_bytes_compressed',
+                  sum(s['compressed'] for s in sizes.values()))
+    metrics.count('text_bytes', sizes)
 
 
 def generate_huffdict(cfg, data, out_fname):
@@ -206,13 +253,252 @@ def generate_huffdict(cfg, data, out_fname):
 
     all_inputs = extract_displayed_strings(cfg, data)
 
-    total_string = b""
-    for j in all_inputs:
-        total_string = total_string + encode_text(j)
-    dictionary = huffmanencoder.create_dictionary(total_string)
+    max_code_length = cfg.getint('options', 'huffman_max_code_length',
+                                 fallback=None)
+    max_tokens = cfg.getint('options', 'text_tokens', fallback=0)
+    objective = cfg.get('options', 'text_objective', fallback='size')
+    if objective not in TEXT_OBJECTIVES:
+        raise ValueError("text_objective must be one of {}".format(
+            ", ".join(TEXT_OBJECTIVES)))
+    fast = objective == 'cycles'
+    wrap = cfg.get('options', 'text_wrap', fallback='pad')
+    if wrap not in TEXT_WRAPS:
+        raise ValueError("text_wrap must be one of {}".format(
+            ", ".join(TEXT_WRAPS)))
+    data['text_wrap'] = wrap
+    if wrap == 'newline':
+        report_text_wrap(data, all_inputs, max_code_length, fast)
+
+    data['text_tokens'] = None
+    if max_tokens > 0:
+        plain = [encode_text(j, wrap) for j in all_inputs]
+        plain_dictionary = huffmanencoder.create_dictionary(
+            huffmanencoder.FrequencyCounter(plain), max_code_length, fast)
+        data['text_tokens'] = texttokens.select_tokens(
+            plain, max_tokens, max_code_length, objective)
+
+    encoded = [encode_display_text(data, j) for j in all_inputs]
+    dictionary = huffmanencoder.create_dictionary(
+        huffmanencoder.FrequencyCounter(encoded), max_code_length, fast)
     data['huffdict'] = dictionary
+    data['huffdicts'] = [dictionary]
+    data['huffdict_assignment'] = {}
+    print("Huffman codes: average {:.3f} bits/symbol, longest {} bits".format(
+        dictionary['average_code_length'], dictionary['max_code_length']))
+    data['metrics'].count('huffman_bits_per_symbol',
+                          dictionary['average_code_length'])
+    data['metrics'].count('huffman_longest_code',
+                          dictionary['max_code_length'])
+    if data['text_tokens'] is not None:
+        report_text_tokens(data, all_inputs, plain, plain_dictionary)
+
+    n_dictionaries = cfg.getint('options', 'text_dictionaries', fallback=1)
+    if n_dictionaries > 1:
+        choose_text_dictionaries(data, encoded, n_dictionaries,
+                                 max_code_length, objective)
+    report_text_cycles(data, encoded)
+
+    with buildmanifest.open_output(out_fname, 'wb') as f:
+        f.write(huffmanencoder.dictionary_to_bytes(data['huffdicts'][0]))
+
+
+def token_expansions(data):
+    """
+    The token codes and their expansions, for the cycle model.
+    """
+    tokens = data.get('text_tokens')
+    if not tokens:
+        return None
+    return dict((texttokens.TOKEN_FIRST + i, expansion)
+                for i, expansion in enumerate(tokens['table']))
 
-    huffmanencoder.write_dictionary(dictionary, out_fname)
+
+def measure_texts(data, dictionaries, assignment, encoded):
+    """
+    ROM bytes and decoding cycles of the encoded strings, each compressed
+    with the dictionary given in assignment.
+    """
+    n = len(dictionaries)
+    tokens = token_expansions(data)
+    cycles = [cyclemodel.code_cycles(d) for d in dictionaries]
+    size = sum(huffmanencoder.dictionary_size(d) for d in dictionaries)
+    string_cycles = []
+    n_chars = 0
+    for v, k in zip(encoded, assignment):
+        # With several dictionaries, each string has a selector byte.
+        size += huffmanencoder.compressed_size(dictionaries[k], v)
+        size += 1 if n > 1 else 0
+        t, c = cyclemodel.text_cycles(dictionaries[k], v, tokens, n,
+                                      cycles[k])
+        string_cycles.append(t)
+        n_chars += c
+    return size, cyclemodel.summarize(string_cycles, n_chars)
+
+
+def choose_text_dictionaries(data, encoded, n_dictionaries,
+                             max_code_length=None, objective='size'):
+    """
+    Try splitting the texts over 2..n_dictionaries dictionaries and keep
+    the split that takes the least ROM, or the fewest decoding cycles with
+    the 'cycles' objective, if it beats the single dictionary.
+    Each string then starts with a byte that selects its dictionary.
+    """
+    def score(size, cycles):
+        return cycles['total'] if objective == 'cycles' else size
+
+    size, cycles = measure_texts(data, [data['huffdict']],
+                                 [0] * len(encoded), encoded)
+    single = size
+    single_cycles = cycles
+    print("Text dictionaries: 1 dictionary, {} bytes, {} T-states".format(
+        size, cycles['total']))
+
+    best = None
+    best_score = score(size, cycles)
+    for n in range(2, n_dictionaries + 1):
+        split = huffmanencoder.create_dictionaries(
+            encoded, n, max_code_length,
+            prefer_zero_bits=objective == 'cycles')
+        size, cycles = measure_texts(data, split['dictionaries'],
+                                     split['assignment'], encoded)
+        print("Text dictionaries: {} dictionaries, {} bytes, {} T-states, "
+              "strings per dictionary {}".format(
+                  len(split['dictionaries']), size, cycles['total'],
+                  [split['assignment'].count(k)
+                   for k in range(len(split['dictionaries']))]))
+        if (len(split['dictionaries']) > 1 and
+                score(size, cycles) < best_score):
+            best = split
+            best_size = size
+            best_cycles = cycles
+            best_score = score(size, cycles)
+
+    if best is None:
+        print("Text dictionaries: using 1 dictionary")
+        return
+    data['huffdicts'] = best['dictionaries']
+    data['huffdict_assignment'] = dict(zip(encoded, best['assignment']))
+    print("Text dictionaries: using {}, {} -> {} bytes, {} -> {} "
+          "T-states".format(len(best['dictionaries']), single, best_size,
+                            single_cycles['total'], best_cycles['total']))
+
+
+def report_text_cycles(data, encoded):
+    """
+    Print the estimated decoding time of the texts, per string and per
+    screen of text.
+    """
+    assignment = [data['huffdict_assignment'].get(v, 0) for v in encoded]
+    _, cycles = measure_texts(data, data['huffdicts'], assignment, encoded)
+    print("Text decoding: {:.0f} T-states per string on average, longest "
+          "{} T-states ({:.1f} ms)".format(
+              cycles['average'], cycles['longest'],
+              cyclemodel.as_milliseconds(cycles['longest'])))
+    print("Text decoding: {:.0f} T-states per character, {:.0f} per screen "
+          "of text ({:.1f} ms, {:.1f} frames)".format(
+              cycles['per_character'], cycles['per_screen'],
+              cyclemodel.as_milliseconds(cycles['per_screen']),
+              cyclemodel.as_frames(cycles['per_screen'])))
+
+
+def compress_text(data, v):
+    """
+    Compress an encoded string with its dictionary. With several
+    dictionaries, the compressed string starts with the index of its
+    dictionary.
+    """
+    index = data['huffdict_assignment'].get(bytes(v), 0)
+    cp = huffmanencoder.create_compressed_array(data['huffdicts'][index], v)
+    if len(data['huffdicts']) > 1:
+        cp.insert(0, index)
+    return cp
+
+
+def write_text_dictionaries(data, fname):
+    """
+    Write the table of the text dictionaries. The first one is the
+    TEXT_HUFFDICT binary; any others are written here.
+    """
+    dictionaries = data['huffdicts']
+    labels = ["TEXT_HUFFDICT"] + ["TEXT_HUFFDICT_{}".format(i)
+                                 for i in range(1, len(dictionaries))]
+    with buildmanifest.open_output(fname) as f:
+        f.write(";; Text dictionaries, selected by the first byte of a "
+                "string when more than one.\n")
+        f.write("C_TEXT_DICTIONARIES: EQU {}\n".format(len(dictionaries)))
+        f.write("TEXT_HUFFDICT_TABLE:\n")
+        f.write("DW {}\n".format(", ".join(labels)))
+        for lbl, dictionary in zip(labels[1:], dictionaries[1:]):
+            f.write("{}:\n".format(lbl))
+            f.write("DB {}\n".format(", ".join(intlist_to_string(
+                huffmanencoder.dictionary_to_bytes(dictionary)))))
+
+
+def report_text_wrap(data, all_inputs, max_code_length=None, fast=False):
+    """
+    Compare the [text] strings wrapped with padding and with newlines,
+    each compressed with a dictionary built for its wrap mode. Tokens are
+    not applied.
+    """
+    n_texts = len(data['texts'])
+    sizes = {}
+    for wrap in TEXT_WRAPS:
+        encoded = [encode_text(j, wrap) for j in all_inputs]
+        dictionary = huffmanencoder.create_dictionary(
+            huffmanencoder.FrequencyCounter(encoded), max_code_length, fast)
+        texts = encoded[:n_texts]
+        sizes[wrap] = (sum(len(v) for v in texts),
+                       sum(huffmanencoder.compressed_size(dictionary, v)
+                           for v in texts))
+    pad_symbols, pad_bytes = sizes['pad']
+    nl_symbols, nl_bytes = sizes['newline']
+    print("Text wrap: [text] symbols {} -> {}, saved {}".format(
+        pad_symbols, nl_symbols, pad_symbols - nl_symbols))
+    print("Text wrap: [text] compressed {} -> {} bytes, saved {} bytes"
+          .format(pad_bytes, nl_bytes, pad_bytes - nl_bytes))
+
+
+def report_text_tokens(data, all_inputs, plain, plain_dictionary):
+    """
+    Compare the texts with and without the token substitution.
+    """
+    tokens = data['text_tokens']
+    tokenized = [encode_display_text(data, j) for j in all_inputs]
+
+    plain_arrays, _ = huffmanencoder.create_compressed_arrays(
+        plain_dictionary, plain)
+    token_arrays, _ = huffmanencoder.create_compressed_arrays(
+        data['huffdict'], tokenized)
+    plain_rom = (sum(len(v) for v in plain_arrays) +
+                 len(plain_dictionary['altdict']) + 1)
+    token_rom = (sum(len(v) for v in token_arrays) +
+                 len(data['huffdict']['altdict']) + 1 +
+                 texttokens.table_size(tokens))
+
+    print("Text tokens: {} in use, decoded symbols {} -> {}".format(
+        len(tokens['table']), sum(len(v) for v in plain),
+        sum(len(v) for v in tokenized)))
+    print("Text tokens: ROM {} -> {} bytes, saved {} bytes".format(
+        plain_rom, token_rom, plain_rom - token_rom))
+
+
+def write_text_tokens(data, fname):
+    """
+    Write the expansions of the text tokens. The table is written even
+    when no tokens are in use, as the text decoder refers to it.
+    """
+    tokens = data.get('text_tokens')
+    table = tokens['table'] if tokens else []
+    with buildmanifest.open_output(fname) as f:
+        f.write(";; Text token expansions, from code {} onwards.\n".format(
+            texttokens.TOKEN_FIRST))
+        f.write("TEXT_TOKEN_TABLE:\n")
+        if table:
+            f.write("DW {}\n".format(", ".join(
+                "__TOKEN_{}".format(i) for i in range(len(table)))))
+        for i, expansion in enumerate(table):
+            f.write("__TOKEN_{}: DB {}, 0\n".format(
+                i, ", ".join(intlist_to_string(expansion))))
 
 
 def extract_displayed_strings(cfg, data):
@@ -220,8 +506,8 @@ def extract_displayed_strings(cfg, data):
     Extract all different strings that will be stored.
     """
     res = []
-    for key in cfg['text']:
-        res.append(cfg['text'][key])
+    for key in data['texts']:
+        res.append(data['texts'][key])
 
     res.extend(PLAYER_COMMANDS.keys())
     res.extend(DIRECTION_VALUES.keys())
@@ -304,11 +590,20 @@ def write_script(data, script_commands, outfn):
     :param script_commands:
     """
 
-    with open(outfn, "w") as f:
+    aliases = {}
+    for alias, script in data.get('script_aliases', {}).items():
+        aliases.setdefault(script, []).append(alias)
+    data['metrics'].count('script_bytes',
+                          scriptopt.script_bytes(script_commands))
+
+    with buildmanifest.open_output(outfn) as f:
         f.write(";;; Game scripts \n")
         for script, cmds in script_commands.items():
             f.write("  {}: ;; Script {}\n".format(
                 as_scriptlabel(script), script))
+            for alias in aliases.get(script, []):
+                f.write("  {}: ;; Script {}, merged\n".format(
+                    as_scriptlabel(alias), alias))
             for cmd in cmds:
                 f.write("  DB {}\n".format(cmd[0]))
                 if cmd[0] == 0:  # END
@@ -351,7 +646,7 @@ def write_script(data, script_commands, outfn):
             f.write("\n\n")
 
 
-def read_input(cfg):
+def read_input(cfg, verbose=True):
     data_collection = {
         'locations': OrderedDict(),
         'items': OrderedDict(),
@@ -361,13 +656,17 @@ def read_input(cfg):
         'used_texts': set([]),
         'used_scripts': set([]),
         'scripts': {},
+        'texts': OrderedDict((k, cfg['text'][k]) for k in cfg['text']),
         'gfxviews': {}
     }
-    print("Reading input")
+    if verbose:
+        print("Reading input")
+    converted = convert_location_images(cfg, verbose)
     for s in cfg.sections():
-        print(s)
+        if verbose:
+            print(s)
         if s.startswith(CFG_LOCATION_HEAD):
-            parse_location(data_collection, cfg, s)
+            parse_location(data_collection, cfg, s, converted[s], verbose)
         elif s.startswith(CFG_ITEM_HEAD):
             parse_item(data_collection, cfg, s)
     parse_scriptfile(data_collection, cfg['in_files']['scripts'])
@@ -409,13 +708,45 @@ def intlist_to_string(s):
     return [str(i) for i in s]
 
 
-def parse_location(data, cfg, loc_key):
+def convert_location_images(cfg, verbose=True):
+    """
+    Cut the images of all locations into tiles, each on its own. With the
+    workers option above 1, the images are converted in that many
+    processes; 0 means one per CPU.
+
+    Returns the local tiles and positions of each location section, see
+    gfxconvert.convert_image().
+    """
+    sections = [s for s in cfg.sections() if s.startswith(CFG_LOCATION_HEAD)]
+    images = [cfg.get(s, 'gfx') for s in sections]
+    convert = functools.partial(
+        tilecache.convert_image,
+        cache_dir=cfg.get('options', 'tile_cache_dir', fallback=None),
+        verbose=verbose,
+        quantize=cfg.getint('options', 'quantize_colours',
+                            fallback=gfxconvert.QUANTIZE_NONE))
+    workers = cfg.getint('options', 'workers', fallback=1)
+    if workers == 0:
+        workers = os.cpu_count()
+    if workers > 1 and len(images) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            converted = list(pool.map(convert, images))
+    else:
+        converted = [convert(fname) for fname in images]
+    return dict(zip(sections, converted))
+
+
+def parse_location(data, cfg, loc_key, converted, verbose=True):
     # cfg = ConfigParser()
     loc_name = loc_key[len(CFG_LOCATION_HEAD):]
-    gfx_file = cfg.get(loc_key, 'gfx')
     defined_chars = data['graphics']['defined_chars']
-    defined_chars, tiles = gfxconvert.create_charset(gfx_file, defined_chars)
-    print("Created tiles.")
+    # Merged in the config order, the tile ids do not depend on the order
+    # in which the images were converted.
+    local_tiles, positions = converted
+    tiles = gfxconvert.merge_charset(defined_chars, local_tiles, positions,
+                                     verbose=verbose)
+    if verbose:
+        print("Created tiles.")
     loc = {'scripts': {}}
     data['locations'][loc_name] = loc
     loc['gfx'] = tiles
@@ -428,7 +759,8 @@ def parse_location(data, cfg, loc_key):
             dname, cmd = rest.split("_")
             for d in DIRECTION_VALUES:
                 if dname.lower() == d.lower():
-                    print("Found command", dname, cmd)
+                    if verbose:
+                        print("Found command", dname, cmd)
 
                     if d not in loc['scripts']:
                         loc['scripts'][d] = {}
@@ -442,6 +774,189 @@ def parse_location(data, cfg, loc_key):
         data['used_scripts'].add("DefaultEntryScript")
 
 
+def merge_similar_tiles(cfg, data):
+    """
+    Replace location tiles with near-duplicates within the error budgets
+    set in [options], if tile_merge_max_pixels is set.
+    """
+    max_pixels = cfg.getint('options', 'tile_merge_max_pixels', fallback=0)
+    if max_pixels <= 0:
+        return
+    budget = cfg.getint('options', 'tile_merge_budget', fallback=None)
+    location_budget = cfg.getint('options', 'tile_merge_location_budget',
+                                 fallback=None)
+    preview_fname = cfg.get('out_files', 'tile_merge_preview',
+                            fallback=None)
+
+    defined_chars = data['graphics']['defined_chars']
+    location_gfx = OrderedDict((loc_name, loc['gfx'])
+                               for loc_name, loc in data['locations'].items())
+    n_before = len(defined_chars)
+    replaced, errors = tilemerge.merge_tiles(
+        defined_chars, location_gfx, max_pixels, budget, location_budget)
+    if preview_fname:
+        tilemerge.write_preview(preview_fname, defined_chars, location_gfx,
+                                replaced)
+    tilemerge.apply_merge(defined_chars, location_gfx, replaced)
+
+    print("Tile merge: {} -> {} tiles, saved {} bytes".format(
+        n_before, len(defined_chars),
+        (n_before - len(defined_chars)) * tilemerge.TILE_BYTES))
+    worst = max(errors, key=errors.get)
+    print("Tile merge: {} pixels changed, most in {} ({})".format(
+        sum(errors.values()), worst, errors[worst]))
+
+
+
+def palette_bytes(location_gfx):
+    return sum(len(LocationGraphics().create_palette(gfx).encode())
+               for gfx in location_gfx.values())
+
+
+def order_tiles(cfg, data):
+    """
+    Renumber the tiles so that the location palettes take less space, if
+    optimize_tile_order is set in [options].
+    """
+    if not cfg.getint('options', 'optimize_tile_order', fallback=0):
+        return
+    location_gfx = OrderedDict((loc_name, loc['gfx'])
+                               for loc_name, loc in data['locations'].items())
+    before = palette_bytes(location_gfx)
+    tileorder.reorder_tiles(data['graphics']['defined_chars'], location_gfx)
+    after = palette_bytes(location_gfx)
+    print("Tile order: location palettes {} -> {} bytes, saved {}".format(
+        before, after, before - after))
+
+
+def optimize_scripts(cfg, data):
+    """
+    Run the peephole pass of scriptopt over the scripts, if
+    optimize_scripts is set in [options], and point the locations and
+    items to the scripts that are kept.
+    """
+    if not cfg.getint('options', 'optimize_scripts', fallback=0):
+        return
+    before = scriptopt.script_bytes(data['scripts'])
+    scripts, aliases, stats = scriptopt.optimize(data['scripts'])
+    data['scripts'] = scripts
+    data['script_aliases'] = aliases
+
+    for loc in data['locations'].values():
+        for cmds in loc['scripts'].values():
+            for cmd in cmds:
+                cmds[cmd] = aliases.get(cmds[cmd], cmds[cmd])
+        if 'entrancescript' in loc:
+            loc['entrancescript'] = aliases.get(loc['entrancescript'],
+                                                loc['entrancescript'])
+    for item_d in data['items'].values():
+        for cmd, scr in item_d['scripts'].items():
+            item_d['scripts'][cmd] = aliases.get(scr, scr)
+
+    after = scriptopt.script_bytes(scripts)
+    print("Scripts: {} fused, {} dead commands dropped, {} jumps threaded, "
+          "{} jumps dropped, {} scripts merged".format(
+              stats['fused'], stats['dropped'], stats['jumps_threaded'],
+              stats['jumps_dropped'], stats['merged']))
+    print("Scripts: {} -> {} bytes, saved {}; {} commands fewer to "
+          "execute over the changed paths".format(
+              before, after, before - after,
+              stats['fused'] + stats['jumps_threaded'] +
+              stats['jumps_dropped']))
+
+
+def plain_text_bytes(cfg, data):
+    """
+    ROM bytes of the [text] strings and of a Huffman dictionary made for
+    all the displayed strings, without tokens or several dictionaries.
+    """
+    wrap = cfg.get('options', 'text_wrap', fallback='pad')
+    max_code_length = cfg.getint('options', 'huffman_max_code_length',
+                                 fallback=None)
+    encoded = [encode_text(s, wrap)
+               for s in extract_displayed_strings(cfg, data)]
+    dictionary = huffmanencoder.create_dictionary(
+        huffmanencoder.FrequencyCounter(encoded), max_code_length)
+    return (huffmanencoder.dictionary_size(dictionary) +
+            sum(huffmanencoder.compressed_size(dictionary, v)
+                for v in encoded[:len(data['texts'])]))
+
+
+def location_record_bytes(loc):
+    n_entries = sum(len(cmds) for cmds in loc['scripts'].values())
+    return 2 + 2 + 2 + 1 + 4 * n_entries + 2
+
+
+def item_record_bytes(item_d):
+    # The record, and the entries in ITEM_ADDRESS_LIST and
+    # ITEM_INIT_LOCATIONS.
+    return 2 + 2 + 1 + 3 * len(item_d['scripts']) + 2 + 2
+
+
+def eliminate_dead_content(cfg, data):
+    """
+    Drop the locations, items, scripts and texts that cannot be reached
+    from the labels the program code refers to, if eliminate_dead_content
+    is set in [options].
+    """
+    if not cfg.getint('options', 'eliminate_dead_content', fallback=0):
+        return
+    roots = deadcontent.source_references(
+        os.path.dirname(cfg['in_files']['main_source']),
+        {'locations': LABELTEMPLATE_LOCATION, 'items': LABELTEMPLATE_ITEM,
+         'scripts': LABELTEMPLATE_SCRIPT, 'texts': LABELTEMPLATE_TEXT})
+    # The items that start with the player, not in any location.
+    roots['items'].update(
+        name for name, item_d in data['items'].items()
+        if item_d['location'] in CONSTANT_MAP and
+        item_d['location'] != TC_LOST_LOC)
+    keep = deadcontent.reachable(data, roots)
+    dropped = dict((kind, [name for name in data[kind]
+                           if name not in keep[kind]])
+                   for kind in deadcontent.KINDS)
+
+    text_before = plain_text_bytes(cfg, data)
+    saved = scriptopt.script_bytes(
+        dict((name, data['scripts'][name]) for name in dropped['scripts']))
+    saved += sum(item_record_bytes(data['items'][name])
+                 for name in dropped['items'])
+    saved += sum(location_record_bytes(data['locations'][name])
+                 for name in dropped['locations'])
+
+    for kind in deadcontent.KINDS:
+        for name in dropped[kind]:
+            del data[kind][name]
+    aliases = data.get('script_aliases', {})
+    for alias in list(aliases):
+        if aliases[alias] not in data['scripts']:
+            del aliases[alias]
+    for item_d in data['items'].values():
+        if (item_d['location'] not in CONSTANT_MAP and
+                item_d['location'] not in data['locations']):
+            # It is never seen where it starts.
+            item_d['location'] = TC_LOST_LOC
+    n_tiles = 0
+    if dropped['locations']:
+        location_gfx = OrderedDict((loc_name, loc['gfx']) for loc_name, loc
+                                   in data['locations'].items())
+        n_tiles = deadcontent.drop_unused_tiles(
+            data['graphics']['defined_chars'], location_gfx)
+        saved += 9 * n_tiles
+    text_after = plain_text_bytes(cfg, data)
+
+    for kind in deadcontent.KINDS:
+        if dropped[kind]:
+            print("Dead content: dropped {} {}: {}".format(
+                len(dropped[kind]), kind, ", ".join(dropped[kind])))
+    if dropped['locations']:
+        print("Dead content: dropped {} tiles of the locations".format(
+            n_tiles))
+    print("Dead content: texts {} -> {} bytes with their dictionary; "
+          "saved {} bytes in total".format(
+              text_before, text_after,
+              saved + text_before - text_after))
+
+
 def prepare_graphics(cfg, data):
     """
     Prepare the graphics tiles to a binary.
@@ -459,7 +974,7 @@ def prepare_graphics(cfg, data):
 
 
 def write_palettes(cfg, data, fname):
-    with open(fname, 'w') as f:
+    with buildmanifest.open_output(fname) as f:
         f.write(";; Palettes for locations.\n")
         for loc_name, loc_d in data['locations'].items():
             locgfx = loc_d['locgfx']
@@ -471,7 +986,7 @@ def write_palettes(cfg, data, fname):
 
 
 def write_graphicsview(cfg, data, fname):
-    with open(fname, 'w') as f:
+    with buildmanifest.open_output(fname) as f:
         f.write(";; Graphics views\n")
         for gfx_name, gfx_d in data['gfxviews'].items():
             ctvd, palette = gfx_d.convert()
@@ -592,7 +1107,7 @@ def write_locations(data, outfn):
     ;; [direction_code][script pointer] * num_of_directions
     ;; [commands to alter the looks]
     """
-    with open(outfn, 'w') as f:
+    with buildmanifest.open_output(outfn) as f:
         for loc, d in data['locations'].items():
             f.write("{}:\n".format(as_locationlabel(loc)))
             # Now, link to description.
@@ -660,7 +1175,7 @@ def write_item(cfg, data, outfname, outramfname):
     :param outfname:
     :return:
     """
-    with open(outfname, "w") as f:
+    with buildmanifest.open_output(outfname) as f:
         f.write(";;; All item addresses.\n")
         f.write("ITEM_ADDRESS_LIST:\n")
         f.write("  DB {} ;; Number of items\n".format(len(data['items'])))
@@ -687,7 +1202,7 @@ def write_item(cfg, data, outfname, outramfname):
                 f.write("    DB {} \n".format(cmd))
                 f.write("    DW {} \n".format(as_scriptlabel(scr)))
 
-    with open(outramfname, 'w') as f:
+    with buildmanifest.open_output(outramfname) as f:
         f.write(";;; Item RAM data.\n")
         f.write("ITEM_RAM_LOCATIONS:\n")
         for item, item_d in data['items'].items():
@@ -695,68 +1210,117 @@ def write_item(cfg, data, outfname, outramfname):
             f.write("  RW 1 ; Item location\n")
 
 
-def write_compressed_string(data, f, v, orig):
-    c = 0
-    cp = huffmanencoder.create_compressed_array(data['huffdict'], v)
-    tot_len = len(cp)
-    f.write(";; Length: {} vs {}\n".format(len(orig), tot_len))
-    while cp:
-        b = cp.pop(0)
-        if c == 0:
-            f.write("\t\tDB {}".format(b))
-        else:
-            f.write(", {}".format(b))
-        c += 1
-        if c == 10 or len(cp) == 0:
-            f.write("\n")
-            c = 0
+def write_compressed_string(data, f, v, orig, compressed=None):
+    if compressed is None:
+        cp = compress_text(data, v)
+    else:
+        cp = list(compressed)
+    f.write(";; Length: {} vs {}\n".format(len(orig), len(cp)))
+    for i in range(0, len(cp), 10):
+        f.write("\t\tDB " + ", ".join(str(b) for b in cp[i:i + 10]) + "\n")
 
 
-def merge_colour_codes(all_colours):
-    remap = dict((k, k) for k in all_colours)
+# The colour table can hold at most this many 8-row colour entries.
+MAX_COLOUR_CODES = 255
 
-    # TODO: This doesn't seem to work as desired
-    found = True
-    # found = False
 
-    print("Reducing used colour codes...")
+def colour_masks(colcode):
+    """
+    Return the set of colours used on each row of a colour code as a
+    16-bit mask. Colour 0 is left out; it only stands for an unused half.
+    """
+    return tuple(((1 << (c & 15)) | (1 << (c >> 4))) & ~1 for c in colcode)
 
-    reduced = 0
-    while found:
-        found = False
-        for clr1, nclr1 in list(remap.items()):
-            for clr2, nclr2 in list(remap.items()):
-                if nclr1 == nclr2:
-                    continue
-                compt, ccode = are_colours_compatible(nclr1, nclr2)
-                if compt:
-                    # print(nclr1, nclr2, ccode)
-                    remap[clr1] = ccode
-                    remap[clr2] = ccode
-                    found = True
-                    reduced += 1
-                    break
-            else:
-                continue
-            break
 
-    print("Reduced used colour maps by", reduced, "/", len(all_colours))
-    return remap
+def masks_to_colour_code(masks):
+    ccodes = []
+    for mask in masks:
+        cols = [c for c in range(16) if mask & (1 << c)] or [0]
+        ccodes.append((min(cols) << 4) + max(cols))
+    return tuple(ccodes)
 
 
-def are_colours_compatible(colcode1, colcode2):
-    ccodes = []
-    for c1, c2 in zip(colcode1, colcode2):
-        cols1 = set([c1 & 15, (c1 >> 4)])
-        cols2 = set([c2 & 15, (c2 >> 4)])
-        cm = cols1 | cols2
-        cm2 = cm - set([0])
-        if len(cm2) > 2:
-            return False, []
-        c1, c2 = min(cm2), max(cm2)
+def merge_colour_codes(all_colours):
+    """
+    Group the colour codes so that no row of a group uses more than two
+    colours, and map every code to the code of its group.
+
+    The codes are placed first fit, the ones with the most two-colour rows
+    first. For each row, the groups are indexed by the colours they use,
+    so the groups a code fits in are found by intersecting bitsets. As a
+    group only gains colours, two groups that could not be merged when
+    the later one was started never can be, so one pass is final.
+    """
+    print("Reducing used colour codes...")
 
-        ccodes.append((c1 << 4) + c2)
-    return True, tuple(ccodes)
+    def two_colour_rows(colcode):
+        return sum(1 for m in colour_masks(colcode) if bin(m).count("1") == 2)
+
+    order = sorted(all_colours, key=lambda c: (-two_colour_rows(c), c))
+    n_rows = len(order[0]) if order else 0
+
+    group_masks = []
+    members = []
+    # Per row, the groups indexed by their colour mask, and the groups
+    # using each colour, as bitsets of group indices.
+    by_mask = [{} for _ in range(n_rows)]
+    using = [[0] * 16 for _ in range(n_rows)]
+    everything = 0
+
+    for colcode in order:
+        masks = colour_masks(colcode)
+        fits = everything
+        for r, mask in enumerate(masks):
+            if fits == 0:
+                break
+            cols = [c for c in range(16) if mask & (1 << c)]
+            if len(cols) == 1:
+                # Any group with this colour or with one colour at most.
+                small = by_mask[r].get(0, 0)
+                for c in range(16):
+                    small |= by_mask[r].get(1 << c, 0)
+                fits &= using[r][cols[0]] | small
+            elif len(cols) == 2:
+                # Only groups using no other colours on this row.
+                fits &= (by_mask[r].get(0, 0) | by_mask[r].get(mask, 0) |
+                         by_mask[r].get(1 << cols[0], 0) |
+                         by_mask[r].get(1 << cols[1], 0))
+
+        if fits:
+            g = (fits & -fits).bit_length() - 1
+            members[g].append(colcode)
+            old_masks = group_masks[g]
+        else:
+            g = len(group_masks)
+            members.append([colcode])
+            old_masks = (0,) * n_rows
+            group_masks.append(old_masks)
+            everything |= 1 << g
+
+        bit = 1 << g
+        new_masks = tuple(m | n for m, n in zip(old_masks, masks))
+        group_masks[g] = new_masks
+        for r, (old, new) in enumerate(zip(old_masks, new_masks)):
+            by_mask[r][old] = by_mask[r].get(old, 0) & ~bit
+            by_mask[r][new] = by_mask[r].get(new, 0) | bit
+            for c in range(16):
+                if new & (1 << c):
+                    using[r][c] |= bit
+
+    remap = {}
+    for masks, group in zip(group_masks, members):
+        if len(group) == 1:
+            remap[group[0]] = group[0]
+            continue
+        merged = masks_to_colour_code(masks)
+        for colcode in group:
+            remap[colcode] = merged
+
+    print("Reduced used colour maps by", len(all_colours) - len(members),
+          "/", len(all_colours))
+    print("Colour table: {} of {} entries used, {} to spare".format(
+        len(members), MAX_COLOUR_CODES, MAX_COLOUR_CODES - len(members)))
+    return remap
 
 
 def write_tilegfx(cfg, data, fname):
@@ -768,7 +1332,7 @@ def write_tilegfx(cfg, data, fname):
     - 1 byte to point to correct colour entry; start + point * 8
     """
 
-    with open(fname, 'w') as f:
+    with buildmanifest.open_output(fname) as f:
         f.write(";; Graphics data.\n"
                 ";; Each pattern takes 9 bytes; 8 for pattern,\n"
                 ";; 1 for colour table index\n")
@@ -780,12 +1344,19 @@ def write_tilegfx(cfg, data, fname):
             all_colours.add(clrs)
 
         colour_remap = merge_colour_codes(all_colours)
+        metrics = data['metrics']
+        metrics.count('tiles', len(defined_chars))
+        # Each colour code has a colour byte for each of its 8 rows.
+        metrics.count('colour_rows_before', sum(len(c) for c in all_colours))
+        metrics.count('colour_rows_after', sum(
+            len(c) for c in set(colour_remap.values())))
 
         f.write("TILE_COLOUR_TABLE:\n"
                 ";; 8 bytes for each distinct colour character.\n")
         all_colours = list(set(colour_remap.values()))
 
-        assert len(all_colours) < 256  # Cannot have more colour patterns now
+        # Cannot have more colour patterns now
+        assert len(all_colours) <= MAX_COLOUR_CODES
 
         for ind, clr in enumerate(all_colours):
             f.write("    DB " +
@@ -795,17 +1366,18 @@ def write_tilegfx(cfg, data, fname):
         f.write("TILE_PATTERN_TABLE:\n ;; tile patterns for each tile.\n")
 
         chlist = sorted([(v, k) for k, v in defined_chars.items()])
-        for ch_ind, ch_pattern in chlist:
-            ptrn, clr = gfxconvert.split_char(ch_pattern)
-            clr = colour_remap[clr]
-            ptrn = gfxconvert.convert_to_palette(ch_pattern, clr)
+        clrs = [colour_remap[gfxconvert.split_char(ch_pattern)[1]]
+                for _, ch_pattern in chlist]
+        ptrns = gfxconvert.convert_tiles_to_palette(
+            [ch_pattern for _, ch_pattern in chlist], clrs)
+        for (ch_ind, ch_pattern), ptrn, clr in zip(chlist, ptrns, clrs):
             f.write(
                 "    DB " + ", ".join(intlist_to_string(ptrn)) + ",  " +
                 str(all_colours.index(clr)) + "; {}\n".format(ch_ind))
 
 
 def write_constants(outfname):
-    with open(outfname, 'w') as f:
+    with buildmanifest.open_output(outfname) as f:
         f.write(";; Constants from the pregenerator.\n")
         f.write("C_PLAYER_INVENTORY: EQU {}\n"
                 .format(CONSTANT_MAP[TC_INVENTORY_LOC]))
@@ -815,18 +1387,169 @@ def write_constants(outfname):
                 .format(CONSTANT_MAP[TC_PLAYER_LOC]))
         f.write("CMD_USE: EQU {}\n"
                 .format(PLAYER_COMMANDS['use']))
+        f.write("C_TEXT_TOKEN_FIRST: EQU {}\n"
+                .format(texttokens.TOKEN_FIRST))
+        f.write("C_TEXT_LINE_LENGTH: EQU {}\n".format(LINE_LENGTH))
 
 
-def produce_data(cfgfile):
-    """Main entrypoint."""
+DATA_BACKENDS = ('asm', 'binary')
+
+# The data sections main.asm includes through data_output, with the labels
+# of their starts.
+DATA_SECTIONS = (
+    ('LOCATION_RECORDS', 'locations_output'),
+    ('PALETTES', 'palette_output'),
+    ('GFXVIEWS', 'gfxview_output'),
+    ('TEXTS', 'texts_output'),
+    ('TILEGFX', 'tilegfx_output'),
+    (None, 'items_ROM_output'),
+    (None, 'script_output'),
+)
+
+# By default, the binary data ends where the 32K ROM does.
+BINARY_DATA_END = 0xc000
+
+
+def write_game_data(cfg, fname):
+    """
+    Write the source that main.asm includes for the location, text,
+    graphics, item and script data. With the asm data_backend it includes
+    their sources; with binary, they are assembled here into one binary at
+    the end of the ROM, and it includes that.
+    """
+    backend = cfg.get('options', 'data_backend', fallback='asm')
+    if backend not in DATA_BACKENDS:
+        raise ValueError("data_backend must be one of {}".format(
+            ", ".join(DATA_BACKENDS)))
+    main_source = cfg.get('in_files', 'main_source')
+    source_dir = os.path.dirname(main_source)
+    sections = [(label, cfg['out_files'][key]) for label, key in DATA_SECTIONS]
+
+    with buildmanifest.open_output(fname) as f:
+        if backend == 'asm':
+            f.write(";; Game data sources.\n")
+            for label, section_fname in sections:
+                if label is not None:
+                    f.write("{}:\n".format(label))
+                f.write('\t\tINCLUDE "{}"\n'.format(
+                    binarybackend.source_path(section_fname, source_dir)))
+            return
+
+        binary_fname = cfg.get('out_files', 'data_binary')
+        ram_fname = cfg['out_files']['items_RAM_output']
+        data_end = int(cfg.get('options', 'binary_data_end',
+                               fallback=str(BINARY_DATA_END)), 0)
+        binary, base, labels = binarybackend.build(
+            sections,
+            [(ram_fname, binarybackend.source_path(ram_fname, source_dir))],
+            main_source, data_end)
+        with buildmanifest.open_output(binary_fname, 'wb') as b:
+            b.write(binary)
+        binarybackend.write_data_include(
+            f, binarybackend.source_path(binary_fname, source_dir), base,
+            labels)
+    print("Binary data: {} bytes at ${:04x}, {} labels".format(
+        len(binary), base, len(labels)))
+
+
+# Options that affect the tile graphics.
+GFX_OPTIONS = ('quantize_colours', 'tile_merge_max_pixels', 'tile_merge_budget',
+               'tile_merge_location_budget', 'optimize_tile_order')
+
+# The counters of write_tilegfx(), kept in the build manifest so that the
+# metrics of a run that skips it still have them.
+TILEGFX_COUNTERS = ('tiles', 'colour_rows_before', 'colour_rows_after')
+
+# The out_files written by produce_data().
+DATA_OUTPUTS = ('palette_output', 'tilegfx_output', 'texts_output',
+                'directions_output', 'locations_output', 'script_output',
+                'items_ROM_output', 'items_RAM_output', 'constants_output',
+                'commands_output', 'huffdict_output', 'tokens_output',
+                'huffdicts_output', 'gfxview_output', 'data_output')
+
+
+def module_files(*modules):
+    return [m.__file__ for m in modules]
+
+
+def program_sources(cfg):
+    """
+    The assembly sources next to main_source: the binary backend reads its
+    EQUs and the dead content elimination the labels they refer to.
+    """
+    source_dir = os.path.dirname(cfg['in_files']['main_source'])
+    return [os.path.join(source_dir, fname)
+            for fname in sorted(os.listdir(source_dir))
+            if fname.endswith(".asm")]
+
+
+def location_images(cfg):
+    return [cfg.get(s, 'gfx') for s in cfg.sections()
+            if s.startswith(CFG_LOCATION_HEAD)]
+
+
+def open_manifest(cfg):
+    fname = cfg.get('out_files', 'build_manifest', fallback=None)
+    if fname is None:
+        raise ValueError("Incremental builds need build_manifest "
+                         "in [out_files]")
+    return buildmanifest.Manifest(fname)
+
+
+def save_metrics(metrics, fname):
+    if fname is not None:
+        metrics.save(fname)
+        print("Build metrics written to {}".format(fname))
+
+
+def produce_data(cfgfile, incremental=False, quiet=False):
+    """
+    Main entrypoint.
+
+    With incremental, the steps whose inputs are unchanged since the last
+    incremental run, as recorded in the build manifest, are skipped. With
+    quiet, only the summaries of the steps are printed. If metrics_output
+    is set in [out_files], the time, memory and counts of the stages are
+    written there as JSON.
+    """
 
     cfg = ConfigParser()
     cfg.optionxform = str
     cfg.read(cfgfile)
 
+    manifest = open_manifest(cfg) if incremental else None
+    metrics_fname = cfg.get('out_files', 'metrics_output', fallback=None)
+    metrics = buildmetrics.Metrics(trace_memory=metrics_fname is not None)
+
+    # Everything depends on the whole configuration, as the texts, items
+    # and locations are numbered over all of it.
+    outputs = [cfg['out_files'][k] for k in DATA_OUTPUTS]
+    if cfg.get('options', 'data_backend', fallback='asm') == 'binary':
+        outputs.append(cfg['out_files']['data_binary'])
+    data_inputs = buildmanifest.inputs_hash(
+        [cfgfile, cfg['in_files']['scripts']] + program_sources(cfg) +
+        location_images(cfg) +
+        module_files(binarybackend, buildmanifest, cyclemodel, deadcontent,
+                     gfxconvert, huffmanencoder, scriptopt, texttokens,
+                     tilecache, tilemerge, tileorder) + [__file__])
+    if manifest is not None and manifest.is_current('data', data_inputs,
+                                                    outputs):
+        if not quiet:
+            print("Data is up to date.")
+        metrics.skip('data')
+        save_metrics(metrics, metrics_fname)
+        return
+
     # 1. Collect all items.
 
-    data = read_input(cfg)
+    with metrics.stage('read_input'):
+        data = read_input(cfg, not quiet)
+    data['metrics'] = metrics
+    metrics.count('tiles_read', len(data['graphics']['defined_chars']))
+    with metrics.stage('optimize_scripts'):
+        optimize_scripts(cfg, data)
+    with metrics.stage('eliminate_dead_content'):
+        eliminate_dead_content(cfg, data)
 
     # 2. Convert the graphics.
 
@@ -844,63 +1567,134 @@ def produce_data(cfgfile):
 
     commandsfname = cfg['out_files']['commands_output']
     huffdictfname = cfg['out_files']['huffdict_output']
+    tokensfname = cfg['out_files']['tokens_output']
+    huffdictsfname = cfg['out_files']['huffdicts_output']
 
     locationgfxname = cfg['out_files']['gfxview_output']
 
-    prepare_graphics(cfg, data)
-    write_palettes(cfg, data, palettefname)
-    write_tilegfx(cfg, data, gfxfname)
+    with metrics.stage('prepare_tiles'):
+        merge_similar_tiles(cfg, data)
+        order_tiles(cfg, data)
+        prepare_graphics(cfg, data)
+
+    # The tile graphics only depend on the location images, in order.
+    gfx_outputs = [palettefname, gfxfname]
+    gfx_inputs = buildmanifest.inputs_hash(
+        location_images(cfg) +
+        module_files(gfxconvert, tilecache, tilemerge, tileorder) +
+        [__file__],
+        [list(data['locations']),
+         [cfg.get('options', k, fallback=None) for k in GFX_OPTIONS]])
+    if manifest is not None and manifest.is_current('tilegfx', gfx_inputs,
+                                                    gfx_outputs):
+        if not quiet:
+            print("Tile graphics are up to date.")
+        metrics.skip('write_tilegfx')
+        # Counters recorded before they were kept are null in the report.
+        recorded = manifest.values('tilegfx')
+        for name in TILEGFX_COUNTERS:
+            metrics.count(name, recorded.get(name))
+    else:
+        with metrics.stage('write_tilegfx'):
+            write_palettes(cfg, data, palettefname)
+            write_tilegfx(cfg, data, gfxfname)
 
     # 3. Create the complete Huffdict.
 
-    generate_huffdict(cfg, data, huffdictfname)
+    with metrics.stage('generate_huffdict'):
+        generate_huffdict(cfg, data, huffdictfname)
+        write_text_tokens(data, tokensfname)
+        write_text_dictionaries(data, huffdictsfname)
     # 4. Create the text archive section.
-    write_texts(cfg, data, textfname)
-    write_direction_names(data, directionsfname)
+    with metrics.stage('write_texts'):
+        write_texts(cfg, data, textfname)
+        write_direction_names(data, directionsfname)
 
     # Create the location file
-    write_locations(data, locationsfname)
+    with metrics.stage('write_locations'):
+        write_locations(data, locationsfname)
 
-    write_script(data, data['scripts'], scriptfname)
+    with metrics.stage('write_script'):
+        write_script(data, data['scripts'], scriptfname)
 
-    write_item(cfg, data, itemfname, itemramfname)
+    with metrics.stage('write_item'):
+        write_item(cfg, data, itemfname, itemramfname)
 
-    write_constants(constantsfname)
+    with metrics.stage('write_tables'):
+        write_constants(constantsfname)
+        write_command_names(data, commandsfname)
+        write_graphicsview(cfg, data, locationgfxname)
 
-    write_command_names(data, commandsfname)
+    with metrics.stage('write_game_data'):
+        write_game_data(cfg, cfg['out_files']['data_output'])
 
-    write_graphicsview(cfg, data, locationgfxname)
+    if not quiet:
+        print("Codes:")
+        print(list(CODE_ALPHA.items()))
 
-    print("Codes:")
-    print(list(CODE_ALPHA.items()))
+    if manifest is not None:
+        manifest.record('tilegfx', gfx_inputs, gfx_outputs,
+                        dict((name, metrics.counters.get(name))
+                             for name in TILEGFX_COUNTERS))
+        manifest.record('data', data_inputs, outputs)
+        manifest.save()
 
+    save_metrics(metrics, metrics_fname)
 
-def produce_gfx(cfgfile):
+
+def screen_outputs(base):
+    return [base + suffix for suffix in ("_chars_rle.bin", ".bin",
+                                         "_colours.bin")]
+
+
+def produce_gfx(cfgfile, incremental=False, quiet=False):
     cfg = ConfigParser()
     cfg.optionxform = str
     cfg.read(cfgfile)
 
-    produce_regular_gfx.convert_font(
-        cfg.get('in_files', 'font'), cfg.get('out_files', 'font')
-    )
-    produce_regular_gfx.convert_sprite(
-        cfg.get('in_files', 'sprites'), cfg.get('out_files', 'sprites')
-    )
-    produce_regular_gfx.convert_titlescreen(
-        cfg.get('in_files', 'title'), cfg.get('out_files', 'title_base')
-    )
-    produce_regular_gfx.convert_gamescreen(
-        cfg.get('in_files', 'ui_view'), cfg.get('out_files', 'ui_view_base')
-    )
+    manifest = open_manifest(cfg) if incremental else None
+    sources = module_files(buildmanifest, gfxconvert, produce_regular_gfx,
+                           screencodecs)
+
+    steps = [
+        ('font', produce_regular_gfx.convert_font, 'font', 'font',
+         [cfg.get('out_files', 'font')]),
+        ('sprites', produce_regular_gfx.convert_sprite, 'sprites', 'sprites',
+         [cfg.get('out_files', 'sprites')]),
+        ('title', produce_regular_gfx.convert_titlescreen, 'title',
+         'title_base', screen_outputs(cfg.get('out_files', 'title_base'))),
+        ('ui_view', produce_regular_gfx.convert_gamescreen, 'ui_view',
+         'ui_view_base', screen_outputs(cfg.get('out_files', 'ui_view_base'))),
+    ]
+    for step, convert, in_key, out_key, outputs in steps:
+        infname = cfg.get('in_files', in_key)
+        inputs = buildmanifest.inputs_hash([infname] + sources)
+        if manifest is not None and manifest.is_current(step, inputs,
+                                                        outputs):
+            if not quiet:
+                print("{} is up to date.".format(infname))
+            continue
+        convert(infname, cfg.get('out_files', out_key), verbose=not quiet)
+        if manifest is not None:
+            manifest.record(step, inputs, outputs)
+
+    if manifest is not None:
+        manifest.save()
 
 
 if __name__ == "__main__":
     # produce_data(os.path.join("content", "samplecontent.cfg"))
 
-    cfgname = os.path.join("..", "resources", "penguingamecontent.cfg")
-
-    produce_gfx(cfgname)
-
-    produce_data(cfgname)
+    parser = argparse.ArgumentParser(description="Generate the game content.")
+    parser.add_argument("cfgfile", nargs="?",
+                        default=os.path.join("..", "resources",
+                                             "penguingamecontent.cfg"))
+    parser.add_argument("--incremental", action="store_true",
+                        help="only regenerate outputs whose inputs changed")
+    parser.add_argument("--quiet", action="store_true",
+                        help="print only the summaries of the steps")
+    args = parser.parse_args()
 
+    produce_gfx(args.cfgfile, args.incremental, args.quiet)
 
+    produce_data(args.cfgfile, args.incremental, args.quiet)
@@ -1,3 +1,6 @@
+from itertools import chain
+
+import numpy as np
 from PIL import Image
 
 
@@ -24,6 +27,133 @@ PALETTE_MAP = {
 
 PALETTE_MAP.update(dict((tuple(k[:3]), v) for k, v in PALETTE_MAP.items()))
 
+# The RGB of each colour index; index 0 is transparent and never chosen.
+PALETTE_RGB = np.zeros((16, 3), dtype=np.int32)
+for _colour, _index in PALETTE_MAP.items():
+    PALETTE_RGB[_index] = _colour[:3]
+
+# Colour quantization done by create_charset().
+QUANTIZE_NONE = 0
+# Every pixel to the nearest colour.
+QUANTIZE_NEAREST = 1
+# As above, but with at most two colours on each 8-pixel row of a tile.
+QUANTIZE_ROWS = 2
+
+_nearest_table = None
+
+
+def palette_indices(pixels):
+    """
+    Map an array of pixels, the channels on the last axis, through
+    PALETTE_MAP. Colours not in PALETTE_MAP become -1.
+    """
+    pixels = np.asarray(pixels)
+    n_channels = pixels.shape[-1]
+    packed = np.zeros(pixels.shape[:-1], dtype=np.int64)
+    for channel in range(n_channels):
+        packed = (packed << 16) | pixels[..., channel].astype(np.int64)
+    colours, inverse = np.unique(packed, return_inverse=True)
+    lookup = []
+    for c in colours.tolist():
+        px = tuple((c >> (16 * (n_channels - 1 - i))) & 0xffff
+                   for i in range(n_channels))
+        lookup.append(PALETTE_MAP.get(px, -1))
+    lookup = np.array(lookup, dtype=np.int16)
+    return lookup[inverse.reshape(-1)].reshape(pixels.shape[:-1])
+
+
+def nearest_colour_table():
+    """
+    Return the index of the nearest colour for every RGB555 colour, 32768
+    entries indexed by (r >> 3) << 10 | (g >> 3) << 5 | b >> 3. Built on
+    the first call.
+    """
+    global _nearest_table
+    if _nearest_table is None:
+        levels = (np.arange(32, dtype=np.int32) << 3) | 4
+        r, g, b = np.meshgrid(levels, levels, levels, indexing="ij")
+        rgb = np.stack([r, g, b], axis=-1).reshape(-1, 1, 3)
+        distances = ((rgb - PALETTE_RGB[None, 1:]) ** 2).sum(axis=2)
+        _nearest_table = (distances.argmin(axis=1) + 1).astype(np.uint8)
+    return _nearest_table
+
+
+def nearest_indices(rgb):
+    """
+    Map an array of RGB pixels, the channels on the last axis, to the
+    indices of their nearest colours.
+    """
+    rgb = np.asarray(rgb).astype(np.int32)
+    rgb555 = (((rgb[..., 0] >> 3) << 10) | ((rgb[..., 1] >> 3) << 5) |
+              (rgb[..., 2] >> 3))
+    return nearest_colour_table()[rgb555]
+
+
+def two_colour_indices(rgb, ignore=None):
+    """
+    Map an image of RGB pixels to colour indices using at most two colours
+    on each 8-pixel row of a tile: the pair with the least squared error,
+    each pixel taking the nearer of the two. Pixels in ignore do not count
+    towards the error.
+    """
+    rgb = np.asarray(rgb).astype(np.int32)
+    h, w = rgb.shape[:2]
+    rows = rgb.reshape((h * w // 8, 8, 3))
+    distances = ((rows[:, :, None] - PALETTE_RGB[None, None, 1:]) ** 2).sum(
+        axis=3)
+    if ignore is not None:
+        distances[np.asarray(ignore).reshape((h * w // 8, 8))] = 0
+    first, second = np.triu_indices(len(PALETTE_RGB) - 1)
+    errors = np.minimum(distances[:, :, first],
+                        distances[:, :, second]).sum(axis=1)
+    best = errors.argmin(axis=1)
+    first, second = first[best][:, None], second[best][:, None]
+    n = np.arange(len(rows))[:, None]
+    pixel = np.arange(8)[None, :]
+    nearer = np.where(distances[n, pixel, first] <=
+                      distances[n, pixel, second], first, second)
+    return (nearer + 1).reshape((h, w))
+
+
+def quantize_image(img, quantize=QUANTIZE_NEAREST):
+    """
+    Return the image with every pixel set to its nearest colour, as RGB or
+    RGBA. With QUANTIZE_ROWS, each 8-pixel row of a tile gets at most two
+    colours, see two_colour_indices(). Pixels in ALPHA are kept as they are.
+    """
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA")
+    pixels = np.asarray(img)
+    keep = np.zeros(pixels.shape[:2], dtype=bool)
+    for colour in ALPHA:
+        if len(colour) == pixels.shape[2]:
+            keep |= np.all(pixels == colour, axis=2)
+
+    if quantize == QUANTIZE_ROWS:
+        indices = two_colour_indices(pixels[..., :3], keep)
+    else:
+        indices = nearest_indices(pixels[..., :3])
+    quantized = pixels.copy()
+    quantized[..., :3] = PALETTE_RGB[indices]
+    if quantized.shape[2] == 4:
+        quantized[..., 3] = 255
+    quantized[keep] = pixels[keep]
+    return Image.fromarray(quantized, img.mode)
+
+
+def tiles_array(chars):
+    """
+    Return the tiles, given as tuples of pixels, as one array.
+    """
+    if chars and all(isinstance(ch, TileKey) for ch in chars):
+        dtypes = set(ch.dtype for ch in chars)
+        shapes = set(len(ch.raw) for ch in chars)
+        if len(dtypes) == 1 and len(shapes) == 1:
+            raw = b"".join(ch.raw for ch in chars)
+            array = np.frombuffer(raw, dtype=dtypes.pop())
+            return array.reshape((len(chars), 64, -1))
+    return np.array(chars)
+
 
 def split_char(char_entry):
     """
@@ -54,60 +184,153 @@ def split_char(char_entry):
     return tuple(pattern), tuple(colours)
 
 
-def create_charset(imgname, defined_chars=None, orientation="horizontal", redundancy=False):
+def image_tiles(img):
     """
-    Read a PNG file and convert it.
+    Convert the image to an array of 8x8 tiles, indexed by tile row and
+    tile column, then pixel row and column and the channels, if any.
+    """
+    pixels = np.asarray(img)
+    h, w = pixels.shape[:2]
+    channels = pixels.shape[2:]
+    tiles = pixels.reshape((h // 8, 8, w // 8, 8) + channels)
+    return np.ascontiguousarray(tiles.swapaxes(1, 2))
+
+
+def alpha_tiles(tiles):
+    """
+    Return the mask of the tiles that contain a pixel in ALPHA.
+    """
+    masked = np.zeros(tiles.shape[:2], dtype=bool)
+    if tiles.ndim < 5:
+        # Single-band pixels are never in ALPHA.
+        return masked
+    for colour in ALPHA:
+        if len(colour) == tiles.shape[4]:
+            masked |= np.all(tiles == colour, axis=4).any(axis=(2, 3))
+    return masked
+
+
+class TileKey(tuple):
+    """
+    A tile as a tuple of pixels, as Image.getpixel() gives them, that also
+    keeps the raw bytes of the tile. Compares and hashes as the plain tuple.
+    """
+
+
+def tile_key(tile):
+    """
+    Return the TileKey of an 8x8 tile array.
+    """
+    if tile.ndim == 2:
+        key = TileKey(tile.reshape(64).tolist())
+    else:
+        key = TileKey(map(tuple, tile.reshape(64, -1).tolist()))
+    key.raw = tile.tobytes()
+    key.dtype = tile.dtype
+    return key
+
+
+def tile_bytes(ch, dtype):
+    """
+    Return the raw bytes of a tile given as a tuple of pixels.
+    """
+    if isinstance(ch, TileKey) and ch.dtype == dtype:
+        return ch.raw
+    if dtype == np.uint8:
+        if isinstance(ch[0], tuple):
+            return bytes(chain.from_iterable(ch))
+        return bytes(ch)
+    return np.array(ch, dtype=dtype).tobytes()
+
+
+def convert_image(imgname, orientation="horizontal", redundancy=False,
+                  quantize=QUANTIZE_NONE, verbose=True):
+    """
+    Read a PNG file and cut it into tiles, without a shared tile table.
+
+    Returns the distinct tiles as TileKeys, in the order they first
+    appear, and the index in that list of the tile at each position.
+    With redundancy, every position gets a tile of its own. Tiles with
+    any pixel in ALPHA are skipped.
     """
     img = Image.open(imgname)
+    if quantize != QUANTIZE_NONE:
+        img = quantize_image(img, quantize)
     w, h = img.size
-    print("Read image size:", w, h)
-    if defined_chars is None:
-        defined_chars = {}
+    if verbose:
+        print("Read image size:", w, h)
 
-    n_key = len(defined_chars)
-    actual_output = {}
+    tiles = image_tiles(img)
+    masked = alpha_tiles(tiles)
 
     if orientation == "horizontal":
-        for y0 in range(0, h, 8):
-            for x0 in range(0, w, 8):
-                ch = []
-                for y in range(y0, y0 + 8):
-                    for x in range(x0, x0 + 8):
-                        px = img.getpixel((x, y))
-                        if px in ALPHA:
-                            break
-                        ch.append(px)
-                    if px in ALPHA:
-                        break
-                if px in ALPHA:
-                    continue
-                ch = tuple(ch)
-                if ch not in defined_chars or redundancy:
-                    key = n_key
-                    n_key += 1
-                    defined_chars[ch] = key
-                actual_output[(x0 / 8, y0 / 8)] = defined_chars[ch]
+        order = [(ty, tx) for ty in range(h // 8) for tx in range(w // 8)]
     else:
-        for x0 in range(0, w, 8):
-            for y0 in range(0, h, 8):
-                ch = []
-                for y in range(y0, y0 + 8):
-                    for x in range(x0, x0 + 8):
-                        px = img.getpixel((x, y))
-                        if px in ALPHA:
-                            break
-                        ch.append(px)
-                    if px in ALPHA:
-                        break
-                if px in ALPHA:
-                    continue
-                ch = tuple(ch)
-                if ch not in defined_chars or redundancy:
-                    key = n_key
-                    n_key += 1
-                    defined_chars[ch] = key
-                actual_output[(x0 / 8, y0 / 8)] = defined_chars[ch]
-    print("Actual output size:", len(actual_output))
+        order = [(ty, tx) for tx in range(w // 8) for ty in range(h // 8)]
+
+    local_tiles = []
+    positions = {}
+    seen = {}
+    for ty, tx in order:
+        if masked[ty, tx]:
+            continue
+        tile = tiles[ty, tx]
+        raw = tile.tobytes()
+        i = seen.get(raw)
+        if i is None or redundancy:
+            i = len(local_tiles)
+            local_tiles.append(tile_key(tile))
+            seen[raw] = i
+        positions[(float(tx), float(ty))] = i
+    return local_tiles, positions
+
+
+def merge_charset(defined_chars, local_tiles, positions, redundancy=False,
+                  verbose=True):
+    """
+    Add the tiles of convert_image() to defined_chars, which maps each
+    tile to its key; the tiles are matched on their raw bytes. Returns
+    the key of the tile at each position.
+    """
+    n_key = len(defined_chars)
+    known = {}
+    if local_tiles:
+        # The tiles of one image share the dtype.
+        dtype = local_tiles[0].dtype
+        known = dict((tile_bytes(ch, dtype), ch) for ch in defined_chars)
+
+    keys = []
+    for ch in local_tiles:
+        known_ch = known.get(ch.raw)
+        if known_ch is None or redundancy:
+            if known_ch is None:
+                known_ch = known[ch.raw] = ch
+            defined_chars[known_ch] = n_key
+            n_key += 1
+        keys.append(defined_chars[known_ch])
+
+    actual_output = dict((pos, keys[i]) for pos, i in positions.items())
+    if verbose:
+        print("Actual output size:", len(actual_output))
+    return actual_output
+
+
+def create_charset(imgname, defined_chars=None, orientation="horizontal",
+                   redundancy=False, quantize=QUANTIZE_NONE, verbose=True):
+    """
+    Read a PNG file and convert it.
+
+    Tiles with any pixel in ALPHA are skipped. defined_chars maps each tile,
+    as a tuple of 64 pixels, to its key; the tiles are matched on their raw
+    bytes. With quantize other than QUANTIZE_NONE, the colours are first
+    mapped to the nearest MSX colours, see quantize_image().
+    """
+    if defined_chars is None:
+        defined_chars = {}
+    local_tiles, positions = convert_image(imgname, orientation, redundancy,
+                                           quantize, verbose)
+    actual_output = merge_charset(defined_chars, local_tiles, positions,
+                                  redundancy, verbose)
     return defined_chars, actual_output
 
 
@@ -132,77 +355,107 @@ def rle_encode_sequence(seq):
     return colourcoding
 
 
+def sorted_tiles(defined_chars):
+    """
+    Return the tiles of defined_chars ordered by their key.
+    """
+    invmap = dict((v, k) for k, v in defined_chars.items())
+    return [k for _, k in sorted(invmap.items())]
+
+
+def tile_palette_indices(chars):
+    """
+    Return the pixels of the tiles as palette indices, an array of 8 rows
+    of 8 pixels per tile.
+    """
+    pixels = tiles_array(chars)
+    if pixels.ndim == 2:
+        pixels = pixels[:, :, None]
+    indices = palette_indices(pixels)
+    if (indices < 0).any():
+        raise KeyError(tuple(pixels[indices < 0][0].tolist()))
+    return indices.reshape((len(chars), 8, 8))
+
+
+def pack_patterns(bits):
+    """
+    Pack an array of 8 rows of 8 pixel bits per tile into pattern bytes,
+    the leftmost pixel in the highest bit.
+    """
+    return np.packbits(bits, axis=-1).reshape(-1).tolist()
+
+
+def convert_tiles_to_palette(chars, colours):
+    """
+    Convert many tiles at once; see convert_to_palette(). Returns the
+    patterns of each tile.
+    """
+    if not chars:
+        return []
+    indices = tile_palette_indices(chars)
+    background = np.array(colours, dtype=np.int16).reshape(-1, 8) & 15
+    patterns = pack_patterns(indices != background[:, :, None])
+    return [patterns[i:i + 8] for i in range(0, len(patterns), 8)]
+
+
 def convert_to_palette(defined_char, colours):
     """
     Take in a defined character and the colour encoding for each
     pixel row; return the character converted to binary using the
     colour mapping defined by colours.
     """
-
-    pxs = []
-    for i in range(0, 64, 8):
-        pxs.append(defined_char[i:(i+8)])
-
-    patterns = []
-    for row, clr in zip(pxs, colours):
-        as_bits = []
-        for i in range(8):
-            c = row[i]
-            if PALETTE_MAP[c] == clr & 15:
-                as_bits.append("0")
-            else:
-                as_bits.append("1")
-        patterns.append(int("".join(as_bits), 2))
-    return patterns
+    return convert_tiles_to_palette([defined_char], [colours])[0]
 
 
 def batch_convert(defined_chars, clr):
-    patterns = []
-    invmap = dict((v, k) for k, v in defined_chars.items())
+    chars = sorted_tiles(defined_chars)
+    if not chars:
+        return []
+    indices = tile_palette_indices(chars)
+    return pack_patterns(indices == clr >> 4)
 
-    c1 = clr >> 4
 
-    for k, vall in sorted(invmap.items()):
-        as_bits = []
-        for i in range(0, 64, 8):
-            v = vall[i:(i + 8)]
-            for c in v:
-                c = PALETTE_MAP[c]
-                if c == c1:
-                    as_bits.append("1")
-                else:
-                    as_bits.append("0")
-                if len(as_bits) == 8:
-                    patterns.append(int("".join(as_bits), 2))
-                    as_bits = []
-    return patterns
+def rle_encode_graphics(defined_chars, first_color=(0, 0)):
+    """
+    Convert the tiles to patterns and a run-length encoded colour table.
+    """
+    colors, patterns = encode_graphics(defined_chars, first_color)
+    return rle_encode_sequence(colors), patterns
+
 
+def encode_graphics(defined_chars, first_color=(0, 0)):
+    """
+    Convert the tiles to patterns and a colour table, a byte per row.
 
-def rle_encode_graphics(defined_chars, first_color=(0, 0)):
-    patterns = []
-    colors = []
-    invmap = dict((v, k) for k, v in defined_chars.items())
+    Each row takes the palette colours of its lowest and highest pixel,
+    ordered; a single-colour row keeps the colours of the previous row if
+    it shares the colour with it.
+    """
+    chars = sorted_tiles(defined_chars)
+    if not chars:
+        return [], []
+    pixels = tiles_array(chars).astype(np.int64)
+    pixels = pixels.reshape((len(chars) * 8, 8, -1))
+    # Pack the channels so that the order of the numbers is the order of
+    # the pixel tuples.
+    packed = np.zeros(pixels.shape[:2], dtype=np.int64)
+    for channel in range(pixels.shape[2]):
+        packed = packed * 256 + pixels[:, :, channel]
+    indices = tile_palette_indices(chars).reshape((-1, 8))
+    rows = np.arange(len(indices))
+    lowest = indices[rows, packed.argmin(axis=1)]
+    highest = indices[rows, packed.argmax(axis=1)]
+    c0s = np.minimum(lowest, highest).tolist()
+    c1s = np.maximum(lowest, highest).tolist()
 
     prev_col = first_color
-    for k, vall in sorted(invmap.items()):
-        as_bits = []
-        for i in range(0, 64, 8):
-            v = vall[i:(i + 8)]
-            c0 = PALETTE_MAP[min(v)]
-            c1 = PALETTE_MAP[max(v)]
-            c0, c1 = min(c0, c1), max(c0, c1)
-            if c0 == c1 and c0 in prev_col:
-                c0, c1 = prev_col
-            for c in v:
-                c = PALETTE_MAP[c]
-                if c == c0:
-                    as_bits.append("0")
-                else:
-                    as_bits.append("1")
-                if len(as_bits) == 8:
-                    patterns.append(int("".join(as_bits), 2))
-                    as_bits = []
-            colors.append(c0 + c1 * 16)
-            prev_col = (c0, c1)
-        colourcoding = rle_encode_sequence(colors)
-    return colourcoding, patterns
+    for r, (c0, c1) in enumerate(zip(c0s, c1s)):
+        if c0 == c1 and c0 in prev_col:
+            c0, c1 = prev_col
+            c0s[r], c1s[r] = c0, c1
+        prev_col = (c0, c1)
+
+    bits = indices != np.array(c0s)[:, None]
+    patterns = pack_patterns(bits)
+    colors = [c0 + c1 * 16 for c0, c1 in zip(c0s, c1s)]
+    return colors, patterns
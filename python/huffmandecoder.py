@@ -0,0 +1,46 @@
+# Reference decoder for the archives made by huffmanencoder.
+# Follows the Decompress routine in src/main.asm step by step, so that the
+# encoder can be checked without assembling the game.
+
+
+def read_dictionary(fname):
+    with open(fname, 'rb') as f:
+        return f.read()
+
+
+def decompress(dictionary, data, offset=0):
+    """
+    Decode one compressed string.
+
+    dictionary is the dictionary as stored in ROM: the end token followed
+    by the tree nodes. Each node is two bytes; if the second byte is 0, the
+    first is the value of a leaf. Otherwise the bytes are the offsets of
+    the 0 and 1 children, counted from the start of the node. The bits of
+    data are read from offset onwards, lowest bit of each byte first.
+
+    Returns the decoded symbols, without the end token, and the offset of
+    the byte following the last one read.
+    """
+    end_token = dictionary[0]
+    tree = dictionary[1:]
+    output = bytearray()
+    node = 0
+    for pos in range(offset, len(data)):
+        c = data[pos]
+        for _ in range(8):
+            node += tree[node + (c & 1)]
+            c >>= 1
+            if tree[node + 1] == 0:
+                value = tree[node]
+                if value == end_token:
+                    return output, pos + 1
+                output.append(value)
+                node = 0
+    raise ValueError("Compressed data ended before the end token")
+
+
+def decompress_all(dictionary, data, offsets):
+    """
+    Decode the strings starting at each of the offsets in data.
+    """
+    return [decompress(dictionary, data, offset)[0] for offset in offsets]
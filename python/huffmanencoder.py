@@ -1,11 +1,11 @@
-from collections import defaultdict
+from collections import Counter, defaultdict
 import heapq
 
 # A custom static Huffman-encoder variant.
 
 
 class Node(object):
-    def __init__(self, value=None, ch0=None, ch1=None):
+    def __init__(self, value=None, ch0=None, ch1=None, keep_order=False):
         self.value = value
         self.parent = None
         if value is not None:
@@ -13,7 +13,7 @@ class Node(object):
         else:
             r0 = ch0.rank
             r1 = ch1.rank
-            if r0 < r1:
+            if r0 < r1 and not keep_order:
                 ch0, ch1 = ch1, ch0
             self.rank = max(r0, r1) + 1
             ch0.parent = self
@@ -26,6 +26,23 @@ class Node(object):
             return "[%d]" % self.value
         return "'%s'" % ('' if not hasattr(self, 'code') else self.code)
 
+class FrequencyCounter(object):
+    """
+    Symbol frequencies and the number of chunks, accumulated one chunk at
+    a time, so that a dictionary can be built without joining the whole
+    corpus. Memory use depends only on the size of the alphabet.
+    """
+    def __init__(self, chunks=()):
+        self.counts = Counter()
+        self.n_chunks = 0
+        for chunk in chunks:
+            self.update(chunk)
+
+    def update(self, chunk):
+        self.counts.update(chunk)
+        self.n_chunks += 1
+
+
 def archive(dictfile, datafile, input):
     freqcount = defaultdict(int)
 
@@ -90,13 +107,9 @@ def archive(dictfile, datafile, input):
         if isinstance(n, Node):
             altdict[i] = node_positions[n.code] - i + (i % 2)
 
-    total_string = "".join(char2bitstring[c] for c in input) + char2bitstring[end_token]
-
-    total_string = total_string + "0" * (8 - len(total_string) % 8)
-    datapart = []
-    for i in range(0, len(total_string), 8):
-        v = "".join(reversed(total_string[i:(i+8)]))
-        datapart.append(int(v, 2))
+    # The archive format always closes with padding, even a full zero byte.
+    codes = create_code_table(char2bitstring)
+    datapart = pack_bits(codes, input, end_token, pad_full_byte=True)
 
     altdict = [end_token] + altdict
 
@@ -109,11 +122,23 @@ def archive(dictfile, datafile, input):
         f.write(output)
 
 
-def create_dictionary(input):
-    freqcount = defaultdict(int)
-
-    for b in input:
-        freqcount[b] += 1
+def create_dictionary(input, max_code_length=None, prefer_zero_bits=False):
+    """
+    Create the code dictionary for the symbols in input, which is either
+    a sequence of symbols or a FrequencyCounter.
+
+    By default the codes come from an unbounded Huffman tree. With
+    max_code_length, the code lengths are limited with package-merge and
+    the codes are assigned canonically, bounding the number of tree steps
+    the decoder takes per symbol. With prefer_zero_bits, the branches are
+    turned so that the decoder takes the faster 0 branch more often.
+    """
+    if isinstance(input, FrequencyCounter):
+        freqcount = defaultdict(int, input.counts)
+        n_chunks = input.n_chunks
+    else:
+        freqcount = defaultdict(int, Counter(input))
+        n_chunks = 1
 
     for end_token in range(256):
         if end_token not in freqcount:
@@ -126,6 +151,30 @@ def create_dictionary(input):
             break
     assert ok  # Code tree failed or would need an escape character.
 
+    if max_code_length is None:
+        root = create_huffman_tree(freqcount)
+    else:
+        lengths = limited_code_lengths(freqcount, max_code_length)
+        root = create_canonical_tree(lengths)
+    if prefer_zero_bits:
+        # Every compressed chunk ends with the end token.
+        weights = dict(freqcount)
+        weights[end_token] = n_chunks
+        orient_tree(root, weights)
+
+    altdict, char2bitstring = serialize_tree(root)
+
+    total = sum(freqcount.values())
+    total_bits = sum(freqcount[b] * len(char2bitstring[b]) for b in freqcount)
+
+    return {"altdict": altdict, "char2bitstring": char2bitstring,
+            "end_token": end_token,
+            "code_table": create_code_table(char2bitstring),
+            "average_code_length": total_bits / total if total else 0.0,
+            "max_code_length": max(len(v) for v in char2bitstring.values())}
+
+
+def create_huffman_tree(freqcount):
     flist = [(freqcount[b], 1, b, Node(value=b)) for b in freqcount]
     flist.sort()
 
@@ -137,11 +186,100 @@ def create_dictionary(input):
         n2 = Node(ch0=n0, ch1=n1)
         heapq.heappush(flist, (fr0 + fr1, n2.rank, _, n2))
 
-    root = flist[0][3]
-
-    dictpart = [end_token]
-    treemodel = defaultdict(lambda: null_token)
-
+    return flist[0][3]
+
+
+def limited_code_lengths(freqcount, max_code_length):
+    """
+    Compute optimal code lengths of at most max_code_length bits with the
+    package-merge algorithm.
+    """
+    symbols = sorted(freqcount, key=lambda b: (freqcount[b], b))
+    if len(symbols) > 2 ** max_code_length:
+        raise ValueError("{} symbols do not fit in codes of {} bits".format(
+            len(symbols), max_code_length))
+    if len(symbols) == 1:
+        return {symbols[0]: 1}
+
+    leaves = [(freqcount[b], (b,)) for b in symbols]
+    packages = leaves
+    for _ in range(max_code_length - 1):
+        merged = [(packages[i][0] + packages[i + 1][0],
+                   packages[i][1] + packages[i + 1][1])
+                  for i in range(0, len(packages) - 1, 2)]
+        # Stable sort: on equal weights, single symbols come first.
+        packages = sorted(leaves + merged, key=lambda p: p[0])
+
+    lengths = dict((b, 0) for b in symbols)
+    for _, members in packages[:2 * len(symbols) - 2]:
+        for b in members:
+            lengths[b] += 1
+    return lengths
+
+
+def create_canonical_tree(lengths):
+    """
+    Build the code tree for canonical codes of the given lengths.
+
+    The canonical codes are bit-complemented, so that the longest codes
+    sit on the 0 branches. The serialized tree stores the 1 branch first,
+    which keeps the forward offsets to the 0 branches short.
+    """
+    codes = {}
+    code = 0
+    prev_length = 0
+    for b in sorted(lengths, key=lambda b: (lengths[b], b)):
+        code <<= lengths[b] - prev_length
+        prev_length = lengths[b]
+        bitstring = bin(code)[2:].zfill(prev_length)
+        codes[bitstring.translate(str.maketrans("01", "10"))] = b
+        code += 1
+
+    def build(prefix):
+        if prefix in codes:
+            return Node(value=codes[prefix])
+        if len(prefix) >= prev_length:
+            raise ValueError("Code lengths do not form a complete code")
+        return Node(ch0=build(prefix + "0"), ch1=build(prefix + "1"),
+                    keep_order=True)
+
+    return build("")
+
+
+def orient_tree(root, freqcount):
+    """
+    Swap the children of the nodes so that the more frequent branch is
+    the 0 branch, as Decompress takes an extra jump on a 1 bit. The code
+    lengths do not change. A swap is skipped where it would push the 0
+    branch beyond a one-byte offset.
+    """
+    weights = {}
+    sizes = {}
+    order = []
+    opers = [root]
+    while opers:
+        n = opers.pop()
+        order.append(n)
+        if n.value is None:
+            opers.extend([n.ch0, n.ch1])
+    for n in reversed(order):
+        if n.value is not None:
+            weights[n] = freqcount[n.value]
+            sizes[n] = 1
+            continue
+        if (weights[n.ch1] > weights[n.ch0] and
+                2 + 2 * sizes[n.ch0] <= 255):
+            n.ch0, n.ch1 = n.ch1, n.ch0
+        weights[n] = weights[n.ch0] + weights[n.ch1]
+        sizes[n] = 1 + sizes[n.ch0] + sizes[n.ch1]
+    return root
+
+
+def serialize_tree(root):
+    """
+    Lay out the code tree in the format described at the end of this file.
+    Returns the tree bytes and the code of each symbol as a '0'/'1' string.
+    """
     root.code = ""
 
     opers = [("", root)]
@@ -155,67 +293,188 @@ def create_dictionary(input):
         prefix, n = opers.pop()
         n.code = prefix
         node_positions[n.code] = len(pt_inds)
-        # Compute my_ind.
-        base = sum([0] + [2 ** i for i in range(len(prefix))])
-        my_ind = base + (1 if not prefix else 1 + int(prefix, 2))
         if n.value is not None:
-            treemodel[my_ind] = n.value
             char2bitstring[n.value] = prefix
             pt_inds.extend([n.value, 0])
         else:
-            treemodel[my_ind] = null_token
             opers.extend([(prefix + "0", n.ch0), (prefix + "1", n.ch1)])
             pt_inds.extend([n.ch0, n.ch1])
 
-    dictpart.extend(treemodel[k] for k in range(max(treemodel.keys()) + 1))
-
     altdict = pt_inds[:]
 
     for i, n in enumerate(pt_inds):
         if isinstance(n, Node):
             altdict[i] = node_positions[n.code] - i + (i % 2)
 
-    return {"altdict": altdict, "char2bitstring": char2bitstring,
-            "end_token": end_token}
+    return altdict, char2bitstring
 
 
-def write_dictionary(dictionary, fname):
+def dictionary_to_bytes(dictionary):
+    """
+    Return the dictionary as stored in ROM: the end token, then the tree.
+    """
     altdict = dictionary['altdict']
     end_token = dictionary['end_token']
-    altdict = [end_token] + altdict
+    if max(altdict) > 255:
+        raise ValueError("Code tree too large for one-byte offsets; "
+                         "limit the code length")
+    return bytearray([end_token] + altdict)
+
 
+def write_dictionary(dictionary, fname):
     with open(fname, 'wb') as f:
-        output = bytearray(altdict)
+        output = dictionary_to_bytes(dictionary)
         f.write(output)
 
 
+def create_code_table(char2bitstring):
+    """
+    Convert the '0'/'1' code strings to (code, length) pairs.
+
+    The bits are stored in output order: the first bit of the code string is
+    the lowest bit of the code, as the decoder reads each byte LSB first.
+    """
+    codes = {}
+    for c, bitstring in char2bitstring.items():
+        code = int(bitstring[::-1], 2) if bitstring else 0
+        codes[c] = (code, len(bitstring))
+    return codes
+
+
+def get_code_table(dictionary):
+    """
+    Return the (code, length) table of the dictionary, creating it if needed.
+    """
+    if 'code_table' not in dictionary:
+        dictionary['code_table'] = create_code_table(
+            dictionary['char2bitstring'])
+    return dictionary['code_table']
+
+
+def pack_bits(codes, input, end_token, pad_full_byte=False):
+    """
+    Pack the codes of input and the end token into bytes, LSB first.
+
+    The last byte is padded with zero bits. With pad_full_byte, a zero byte
+    is added even when the bits end at a byte boundary.
+    """
+    output = bytearray()
+    acc = 0
+    n_bits = 0
+    for c in input:
+        code, length = codes[c]
+        acc |= code << n_bits
+        n_bits += length
+        if n_bits >= 64:
+            output += (acc & 0xffffffffffffffff).to_bytes(8, 'little')
+            acc >>= 64
+            n_bits -= 64
+    code, length = codes[end_token]
+    acc |= code << n_bits
+    n_bits += length
+
+    n_bytes = (n_bits + 7) // 8
+    if pad_full_byte and n_bits % 8 == 0:
+        n_bytes += 1
+    output += acc.to_bytes(n_bytes, 'little')
+    return output
+
+
 def create_compressed_array(dictionary, input):
-    char2bitstring = dictionary['char2bitstring']
-    altdict = dictionary['altdict']
-    end_token = dictionary['end_token']
-    total_string = "".join(char2bitstring[c] for c in input) + char2bitstring[end_token]
+    codes = get_code_table(dictionary)
+    return list(pack_bits(codes, input, dictionary['end_token']))
 
-    if len(total_string) % 8 != 0:
-        total_string = total_string + "0" * (8 - len(total_string) % 8)
-    datapart = []
-    for i in range(0, len(total_string), 8):
-        v = "".join(reversed(total_string[i:(i + 8)]))
-        datapart.append(int(v, 2))
-    return datapart
 
+def create_compressed_arrays(dictionary, inputs):
+    """
+    Compress all the sequences in inputs with the same dictionary.
 
-def create_archive(dictionary, input, fname):
-    char2bitstring = dictionary['char2bitstring']
-    altdict = dictionary['altdict']
+    Returns the compressed byte arrays and the offset of each one when they
+    are laid out back to back.
+    """
+    codes = get_code_table(dictionary)
     end_token = dictionary['end_token']
-    total_string = "".join(char2bitstring[c] for c in input) + char2bitstring[end_token]
-
-    if len(total_string) % 8 != 0:
-        total_string = total_string + "0" * (8 - len(total_string) % 8)
-    datapart = []
-    for i in range(0, len(total_string), 8):
-        v = "".join(reversed(total_string[i:(i + 8)]))
-        datapart.append(int(v, 2))
+    arrays = []
+    offsets = []
+    offset = 0
+    for input in inputs:
+        datapart = pack_bits(codes, input, end_token)
+        arrays.append(datapart)
+        offsets.append(offset)
+        offset += len(datapart)
+    return arrays, offsets
+
+
+def compressed_size(dictionary, input):
+    """
+    Size in bytes of input when compressed with the dictionary, or None
+    if the dictionary has no code for some of its symbols.
+    """
+    code_table = dictionary['code_table']
+    n_bits = code_table[dictionary['end_token']][1]
+    for c in input:
+        if c not in code_table:
+            return None
+        n_bits += code_table[c][1]
+    return (n_bits + 7) // 8
+
+
+def dictionary_size(dictionary):
+    return len(dictionary['altdict']) + 1
+
+
+def create_dictionaries(inputs, n_dictionaries, max_code_length=None,
+                        max_rounds=20, prefer_zero_bits=False):
+    """
+    Create up to n_dictionaries dictionaries and assign each input to one.
+
+    The inputs start out split by their length, short ones first. Then,
+    in rounds, each dictionary is rebuilt from the inputs assigned to it
+    and every input moves to the dictionary that codes it smallest, until
+    the assignment settles. Dictionaries left without inputs are dropped.
+
+    Returns a dict with the dictionaries, the index of the dictionary for
+    each input and the total size of the dictionaries and compressed data,
+    for the round that gave the smallest total.
+    """
+    inputs = [bytes(v) for v in inputs]
+    order = sorted(range(len(inputs)), key=lambda i: len(inputs[i]))
+    assignment = [0] * len(inputs)
+    for rank, i in enumerate(order):
+        assignment[i] = rank * n_dictionaries // max(len(inputs), 1)
+
+    best = None
+    for _ in range(max_rounds):
+        groups = sorted(set(assignment))
+        renumber = dict((k, i) for i, k in enumerate(groups))
+        assignment = [renumber[k] for k in assignment]
+        dictionaries = []
+        for k in range(len(groups)):
+            dictionaries.append(create_dictionary(FrequencyCounter(
+                v for v, a in zip(inputs, assignment) if a == k),
+                max_code_length, prefer_zero_bits))
+
+        size = sum(dictionary_size(d) for d in dictionaries)
+        size += sum(compressed_size(dictionaries[a], v)
+                    for v, a in zip(inputs, assignment))
+        if best is None or size < best['size']:
+            best = {'dictionaries': dictionaries,
+                    'assignment': list(assignment),
+                    'size': size}
+
+        reassigned = []
+        for v in inputs:
+            sizes = [compressed_size(d, v) for d in dictionaries]
+            reassigned.append(min((s, k) for k, s in enumerate(sizes)
+                                  if s is not None)[1])
+        if reassigned == assignment:
+            break
+        assignment = reassigned
+    return best
+
+
+def create_archive(dictionary, input, fname):
+    datapart = create_compressed_array(dictionary, input)
 
     with open(fname, 'wb') as f:
         output = bytearray(datapart)
@@ -1,65 +1,72 @@
+import buildmanifest
 import gfxconvert
+import screencodecs
 
 
-def convert_font(infname, outfname):
+def convert_font(infname, outfname, verbose=True):
     # First, the text
-    defchars, output = gfxconvert.create_charset(infname)
+    defchars, output = gfxconvert.create_charset(infname, verbose=verbose)
     colour = (1 << 4) + 2
 
     patterns = gfxconvert.batch_convert(defchars, colour)
 
-    with open(outfname, 'wb') as f:
+    with buildmanifest.open_output(outfname, 'wb') as f:
         barr = bytes(patterns)
         f.write(barr)
 
 
-def convert_sprite(infname, outfname):
+def convert_sprite(infname, outfname, verbose=True):
 
-    defchars, output = gfxconvert.create_charset(infname, orientation="vertical", redundancy=True)
-    print("Defchar length", len(defchars))
+    defchars, output = gfxconvert.create_charset(infname, orientation="vertical", redundancy=True,
+                                                 verbose=verbose)
+    if verbose:
+        print("Defchar length", len(defchars))
     # ccoding, patterns = gfxconvert.rle_encode_graphics(defchars, (10, 0))
     colour = (15 << 4) + 12
     patterns = gfxconvert.batch_convert(defchars, colour)
 
-    with open(outfname, 'wb') as f:
+    with buildmanifest.open_output(outfname, 'wb') as f:
         barr = bytes(patterns)
         f.write(barr)
 
 
-def convert_titlescreen(infname, outfname_base):
+def convert_titlescreen(infname, outfname_base, verbose=True):
     #infname = "../resources/general/gadventure_title.png"
-    defchars, output = gfxconvert.create_charset(infname)
-    ccoding, patterns = gfxconvert.rle_encode_graphics(defchars)
+    defchars, output = gfxconvert.create_charset(infname, verbose=verbose)
+    colours, patterns = gfxconvert.encode_graphics(defchars)
 
     base_offset = 0
     unpacked_scr = []
     for y in range(24):
         for x in range(32):
             unpacked_scr.append(output[(x, y)] + base_offset)
-        print(unpacked_scr[-32:])
+        if verbose:
+            print(unpacked_scr[-32:])
 
     outname = outfname_base + "_chars_rle.bin"
-    with open(outname, 'wb') as f:
-        scr_rle = gfxconvert.rle_encode_sequence(unpacked_scr)
+    with buildmanifest.open_output(outname, 'wb') as f:
+        scr_rle = screencodecs.encode_best(unpacked_scr, "Title screen",
+                                           verbose)
         barr = bytes(scr_rle)
         f.write(barr)
 
     outname = outfname_base + ".bin"
 
-    with open(outname, 'wb') as f:
+    with buildmanifest.open_output(outname, 'wb') as f:
         barr = bytes(patterns)
         f.write(barr)
 
     outname = outfname_base + "_colours.bin"
-    with open(outname, 'wb') as f:
+    with buildmanifest.open_output(outname, 'wb') as f:
+        ccoding = screencodecs.encode_best(colours, "Title colours", verbose)
         barr = bytes(ccoding)
         f.write(barr)
 
 
-def convert_gamescreen(infname, outfname_base):
-    defchars, output = gfxconvert.create_charset(infname)
+def convert_gamescreen(infname, outfname_base, verbose=True):
+    defchars, output = gfxconvert.create_charset(infname, verbose=verbose)
 
-    ccoding, patterns = gfxconvert.rle_encode_graphics(defchars)
+    colours, patterns = gfxconvert.encode_graphics(defchars)
 
     base_offset = 75
 
@@ -67,21 +74,23 @@ def convert_gamescreen(infname, outfname_base):
     for y in range(24):
         for x in range(32):
             unpacked_scr.append(output[(x, y)] + base_offset)
-        print(unpacked_scr[-32:])
+        if verbose:
+            print(unpacked_scr[-32:])
 
-    scr_rle = gfxconvert.rle_encode_sequence(unpacked_scr)
+    scr_rle = screencodecs.encode_best(unpacked_scr, "UI screen", verbose)
 
     outname = outfname_base + ".bin"
-    with open(outname, 'wb') as f:
+    with buildmanifest.open_output(outname, 'wb') as f:
         barr = bytes(patterns)
         f.write(barr)
 
     outname = outfname_base + "_colours.bin"
-    with open(outname, 'wb') as f:
+    with buildmanifest.open_output(outname, 'wb') as f:
+        ccoding = screencodecs.encode_best(colours, "UI colours", verbose)
         barr = bytes(ccoding)
         f.write(barr)
 
     outname = outfname_base + "_chars_rle.bin"
-    with open(outname, 'wb') as f:
+    with buildmanifest.open_output(outname, 'wb') as f:
         barr = bytes(scr_rle)
         f.write(barr)
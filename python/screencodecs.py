@@ -0,0 +1,232 @@
+import gfxconvert
+
+# Codecs for the byte streams unpacked to VRAM: the screen name tables and
+# the colour tables. Each stream starts with a byte naming its codec;
+# Unpack2VRAM in viewrender.asm reads it and calls the matching decoder.
+#
+# CODEC_RLE: [count][value] pairs, count 0 ends.
+# CODEC_LITERAL_RLE: [n][value] repeats value n times for n in 1..127,
+#   [128 + n - 1][n bytes] copies n literal bytes for n in 1..128, 0 ends.
+# CODEC_LZ: [n][n bytes] copies n literal bytes for n in 1..127,
+#   [128 + n - 3][distance - 1] copies n bytes for n in 3..130 from
+#   distance bytes back in the output, 0 ends.
+
+CODEC_RLE = 0
+CODEC_LITERAL_RLE = 1
+CODEC_LZ = 2
+
+CODEC_NAMES = {
+    CODEC_RLE: "RLE",
+    CODEC_LITERAL_RLE: "literal RLE",
+    CODEC_LZ: "LZ",
+}
+
+MAX_RUN = 127
+MAX_LITERALS = 128
+MAX_LZ_LITERALS = 127
+MIN_MATCH = 3
+MAX_MATCH = 130
+MAX_DISTANCE = 256
+
+
+def encode_rle(seq):
+    return list(gfxconvert.rle_encode_sequence(seq))
+
+
+def run_lengths(seq, limit):
+    """
+    The length of the run of equal values starting at each position.
+    """
+    runs = [0] * len(seq)
+    for i in range(len(seq) - 1, -1, -1):
+        if i + 1 < len(seq) and seq[i + 1] == seq[i]:
+            runs[i] = min(runs[i + 1] + 1, limit)
+        else:
+            runs[i] = 1
+    return runs
+
+
+def encode_literal_rle(seq):
+    """
+    Encode with runs and literal stretches, choosing the split with the
+    fewest bytes, then the fewest commands.
+    """
+    n = len(seq)
+    runs = run_lengths(seq, MAX_RUN)
+    best = [None] * (n + 1)
+    best[n] = (0, 0, None)
+    for i in range(n - 1, -1, -1):
+        options = []
+        for length in range(1, runs[i] + 1):
+            b, c, _ = best[i + length]
+            options.append((b + 2, c + 1, ('run', length)))
+        for length in range(1, min(MAX_LITERALS, n - i) + 1):
+            b, c, _ = best[i + length]
+            options.append((b + 1 + length, c + 1, ('literal', length)))
+        best[i] = min(options)
+
+    output = []
+    i = 0
+    while i < n:
+        kind, length = best[i][2]
+        if kind == 'run':
+            output.extend([length, seq[i]])
+        else:
+            output.append(128 + length - 1)
+            output.extend(seq[i:i + length])
+        i += length
+    output.append(0)
+    return output
+
+
+def longest_matches(seq):
+    """
+    The longest earlier match for each position, as (length, distance).
+    The match may overlap the position, as the decoder copies byte by byte.
+    """
+    n = len(seq)
+    matches = []
+    for i in range(n):
+        best = (0, 0)
+        for d in range(1, min(MAX_DISTANCE, i) + 1):
+            length = 0
+            while (i + length < n and length < MAX_MATCH and
+                   seq[i + length] == seq[i + length - d]):
+                length += 1
+            if length > best[0]:
+                best = (length, d)
+        matches.append(best)
+    return matches
+
+
+def encode_lz(seq):
+    """
+    Encode with literal stretches and copies from earlier output, choosing
+    the split with the fewest bytes, then the fewest commands.
+    """
+    n = len(seq)
+    matches = longest_matches(seq)
+    best = [None] * (n + 1)
+    best[n] = (0, 0, None)
+    for i in range(n - 1, -1, -1):
+        options = []
+        max_length, distance = matches[i]
+        for length in range(MIN_MATCH, max_length + 1):
+            b, c, _ = best[i + length]
+            options.append((b + 2, c + 1, ('match', length, distance)))
+        for length in range(1, min(MAX_LZ_LITERALS, n - i) + 1):
+            b, c, _ = best[i + length]
+            options.append((b + 1 + length, c + 1, ('literal', length, 0)))
+        best[i] = min(options)
+
+    output = []
+    i = 0
+    while i < n:
+        kind, length, distance = best[i][2]
+        if kind == 'match':
+            output.extend([128 + length - MIN_MATCH, distance - 1])
+        else:
+            output.append(length)
+            output.extend(seq[i:i + length])
+        i += length
+    output.append(0)
+    return output
+
+
+def decode_rle(data, work=None):
+    output = []
+    i = 0
+    while data[i] != 0:
+        output.extend([data[i + 1]] * data[i])
+        i += 2
+        _count(work, 'commands', 1)
+        _count(work, 'bios_calls', 1)
+    return output
+
+
+def decode_literal_rle(data, work=None):
+    output = []
+    i = 0
+    while data[i] != 0:
+        n = data[i]
+        if n < 128:
+            output.extend([data[i + 1]] * n)
+            i += 2
+        else:
+            n -= 127
+            output.extend(data[i + 1:i + 1 + n])
+            i += 1 + n
+        _count(work, 'commands', 1)
+        _count(work, 'bios_calls', 1)
+    return output
+
+
+def decode_lz(data, work=None):
+    output = []
+    i = 0
+    while data[i] != 0:
+        n = data[i]
+        if n < 128:
+            output.extend(data[i + 1:i + 1 + n])
+            i += 1 + n
+            _count(work, 'bios_calls', 1)
+        else:
+            n += MIN_MATCH - 128
+            distance = data[i + 1] + 1
+            for _ in range(n):
+                output.append(output[-distance])
+            i += 2
+            # One VRAM read and one write per byte copied.
+            _count(work, 'bios_calls', 2 * n)
+        _count(work, 'commands', 1)
+    return output
+
+
+def _count(work, key, n):
+    if work is not None:
+        work[key] = work.get(key, 0) + n
+
+
+ENCODERS = {
+    CODEC_RLE: encode_rle,
+    CODEC_LITERAL_RLE: encode_literal_rle,
+    CODEC_LZ: encode_lz,
+}
+
+DECODERS = {
+    CODEC_RLE: decode_rle,
+    CODEC_LITERAL_RLE: decode_literal_rle,
+    CODEC_LZ: decode_lz,
+}
+
+
+def decode(data, work=None):
+    """
+    Decode a stream that starts with its codec byte.
+    """
+    return DECODERS[data[0]](data[1:], work)
+
+
+def encode_best(seq, name="", verbose=True):
+    """
+    Encode seq with every codec and return the smallest, with its codec
+    byte in front; on equal size, the one with the least decoding work.
+    Prints the candidates, or without verbose only the chosen one.
+    """
+    candidates = []
+    for codec, encoder in sorted(ENCODERS.items()):
+        data = [codec] + encoder(seq)
+        work = {}
+        if decode(data, work) != list(seq):
+            raise AssertionError("{} round trip failed for {}".format(
+                CODEC_NAMES[codec], name))
+        candidates.append((len(data), work['bios_calls'], codec, data, work))
+
+    chosen = min(candidates, key=lambda c: c[:3])
+    for size, calls, codec, _, work in candidates:
+        if not verbose and codec != chosen[2]:
+            continue
+        print("{}: {:<11} {:>4} bytes, {:>4} commands, {:>4} VRAM calls{}"
+              .format(name, CODEC_NAMES[codec], size, work['commands'], calls,
+                      " <- chosen" if codec == chosen[2] else ""))
+    return chosen[3]
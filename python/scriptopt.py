@@ -0,0 +1,163 @@
+from collections import OrderedDict
+
+# Peephole optimisation of the parsed scripts.
+#
+# The scripts are lists of command tuples as parse_scriptfile() in
+# generate_content.py makes them, the command code first. The pass
+#  - drops the commands after one that ends the script,
+#  - fuses TEXT, GOTO and TAKE followed by END into TEXTEND, GOEND and
+#    TAKEEND,
+#  - threads IFTRUE jumps: IFTRUE only jumps when the condition flag is
+#    set and does not change it, so a jump to a script that starts with
+#    another IFTRUE can go straight to that one's target, and a jump to a
+#    script that does the same as the commands after the IFTRUE is dropped,
+#  - merges scripts with identical commands, so that all references go to
+#    the first of them and the others are left as aliases of its label.
+
+END = 0
+GOTO = 1
+SETITEMLOC = 2
+TEXT = 3
+IFTRUE = 4
+ISLOC = 6
+GOEND = 9
+TEXTEND = 10
+TAKE = 11
+TAKEEND = 12
+ISOBJECT = 13
+LOCATIONTEXTEND = 14
+
+ENDS = (END, GOEND, TEXTEND, TAKEEND, LOCATIONTEXTEND)
+FUSED = {TEXT: TEXTEND, GOTO: GOEND, TAKE: TAKEEND}
+
+# Bytes of each command, by its code, with the operands.
+COMMAND_SIZES = {
+    0: 1,  # END
+    1: 3,  # GOTO
+    2: 5,  # SETITEMLOC
+    3: 3,  # TEXT
+    4: 3,  # IFTRUE
+    5: 3,  # SET
+    6: 3,  # ISLOC
+    7: 3,  # ISSTATE
+    8: 5,  # SETTILE
+    9: 3,  # GOEND
+    10: 3,  # TEXTEND
+    11: 3,  # TAKE
+    12: 3,  # TAKEEND
+    13: 4,  # ISOBJECT
+    14: 1,  # LOCATIONTEXTEND
+    15: 1,  # WAITFORFIRE
+}
+
+
+def script_bytes(scripts):
+    return sum(COMMAND_SIZES[cmd[0]] for cmds in scripts.values()
+               for cmd in cmds)
+
+
+def peephole(cmds, stats):
+    """
+    Drop the commands after the end of the script and fuse the commands
+    followed by END.
+    """
+    res = []
+    n_used = 0
+    for cmd in cmds:
+        if res and res[-1][0] in ENDS:
+            break
+        n_used += 1
+        if cmd[0] == END and res and res[-1][0] in FUSED:
+            res[-1] = (FUSED[res[-1][0]],) + res[-1][1:]
+            stats['fused'] += 1
+        else:
+            res.append(cmd)
+    stats['dropped'] += len(cmds) - n_used
+    return res
+
+
+def resolve(name, aliases):
+    while name in aliases:
+        name = aliases[name]
+    return name
+
+
+def jump_target(name, scripts, aliases):
+    """
+    Where IFTRUE name ends up: follow the scripts that start with IFTRUE.
+    Returns the target and the number of jumps skipped.
+    """
+    name = resolve(name, aliases)
+    seen = set([name])
+    hops = 0
+    while scripts.get(name) and scripts[name][0][0] == IFTRUE:
+        target = resolve(scripts[name][0][1], aliases)
+        if target in seen:
+            break
+        seen.add(target)
+        name = target
+        hops += 1
+    return name, hops
+
+
+def thread_jumps(scripts, aliases, stats):
+    """
+    Retarget or drop the IFTRUE commands. Returns True if any changed.
+    """
+    changed = False
+    for name, cmds in scripts.items():
+        res = []
+        for i, cmd in enumerate(cmds):
+            if cmd[0] != IFTRUE:
+                res.append(cmd)
+                continue
+            target, hops = jump_target(cmd[1], scripts, aliases)
+            if scripts.get(target) == cmds[i + 1:]:
+                stats['jumps_dropped'] += 1
+                changed = True
+                continue
+            if target != cmd[1]:
+                stats['jumps_threaded'] += hops
+                changed = True
+            res.append((IFTRUE, target))
+        scripts[name] = res
+    return changed
+
+
+def merge_duplicates(scripts, aliases):
+    """
+    Make the later copies of identical scripts aliases of the first one.
+    Returns True if any were merged.
+    """
+    first = {}
+    changed = False
+    for name in list(scripts):
+        key = tuple(scripts[name])
+        if key in first:
+            aliases[name] = first[key]
+            del scripts[name]
+            changed = True
+        else:
+            first[key] = name
+    return changed
+
+
+def optimize(scripts):
+    """
+    Optimise the scripts. Returns the new scripts, the aliases of the
+    merged scripts (name -> script kept) and the statistics of the pass.
+    """
+    stats = {'fused': 0, 'dropped': 0, 'jumps_threaded': 0,
+             'jumps_dropped': 0}
+    res = OrderedDict((name, peephole(cmds, stats))
+                      for name, cmds in scripts.items())
+    aliases = {}
+    while True:
+        threaded = thread_jumps(res, aliases, stats)
+        merged = merge_duplicates(res, aliases)
+        if not threaded and not merged:
+            break
+    for name in aliases:
+        aliases[name] = resolve(name, aliases)
+    stats['merged'] = len(aliases)
+    return res, aliases, stats
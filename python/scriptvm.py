@@ -0,0 +1,292 @@
+from collections import OrderedDict
+from configparser import ConfigParser
+
+import generate_content as gc
+
+# Interpreter for the game scripts, as ExecuteScriptHL in
+# src/exec_script.asm runs them, working on the parsed script tuples in
+# data['scripts'] instead of the assembled bytes.
+#
+# The state is the player location, the location of each item, the
+# GAME_STATE bytes and the log of the texts shown. Byte 0 of GAME_STATE
+# is the flag that ISLOC, ISSTATE and ISOBJECT set and IFTRUE tests.
+# Names are resolved as tniASM resolves the labels, whatever their case.
+
+END = gc.COMMAND_MAP["END"]
+GOTO = gc.COMMAND_MAP["GOTO"]
+SETITEMLOC = gc.COMMAND_MAP["SETITEMLOC"]
+TEXT = gc.COMMAND_MAP["TEXT"]
+IFTRUE = gc.COMMAND_MAP["IFTRUE"]
+SET = gc.COMMAND_MAP["SET"]
+ISLOC = gc.COMMAND_MAP["ISLOC"]
+ISSTATE = gc.COMMAND_MAP["ISSTATE"]
+SETTILE = gc.COMMAND_MAP["SETTILE"]
+GOEND = gc.COMMAND_MAP["GOEND"]
+TEXTEND = gc.COMMAND_MAP["TEXTEND"]
+TAKE = gc.COMMAND_MAP["TAKE"]
+TAKEEND = gc.COMMAND_MAP["TAKEEND"]
+ISOBJECT = gc.COMMAND_MAP["ISOBJECT"]
+LOCATIONTEXTEND = gc.COMMAND_MAP["LOCATIONTEXTEND"]
+WAITFORFIRE = gc.COMMAND_MAP["WAITFORFIRE"]
+
+ENDS = (END, GOEND, TEXTEND, TAKEEND, LOCATIONTEXTEND)
+
+# GAME_STATE: RB 16 in main.asm.
+GAME_STATE_SIZE = 16
+
+# The location GameInit in main.asm starts the game from.
+START_LOCATION = "Home"
+
+CMD_USE = gc.PLAYER_COMMANDS['use']
+
+# The kinds of hotspots, as in ScanLocationHotspots.
+DIRECTION = 'direction'
+ITEM = 'item'
+
+
+class ScriptError(Exception):
+    pass
+
+
+class GameState(object):
+    """
+    What the scripts change. texts is None when the texts are not logged.
+    """
+
+    def __init__(self, location, items, flags, texts):
+        self.location = location
+        self.items = items
+        self.flags = flags
+        self.texts = texts
+
+    def copy(self):
+        return GameState(self.location, dict(self.items), list(self.flags),
+                         None if self.texts is None else list(self.texts))
+
+    def key(self):
+        """
+        A hashable value that is equal for equal states, leaving out the
+        texts.
+        """
+        # The items keep their order, as they are only ever updated.
+        return (self.location, tuple(self.items.values()), tuple(self.flags))
+
+
+class ScriptMachine(object):
+    """
+    Runs the scripts of the parsed game data.
+    """
+
+    def __init__(self, data, start_location=START_LOCATION):
+        self.lookup = dict(
+            (kind, dict((name.lower(), name) for name in data[kind]))
+            for kind in ('locations', 'items', 'texts'))
+        self.aliases = data.get('script_aliases', {})
+        script_names = dict((name.lower(), name) for name in data['scripts'])
+        script_names.update((alias.lower(), script)
+                            for alias, script in self.aliases.items())
+        self.lookup['scripts'] = script_names
+
+        self.scripts = dict((name, self.compile(name, cmds))
+                            for name, cmds in data['scripts'].items())
+        self.descriptions = dict(
+            (name, loc['description'])
+            for name, loc in data['locations'].items())
+        self.entrance = dict(
+            (name, self.resolve('scripts', loc['entrancescript']))
+            for name, loc in data['locations'].items()
+            if 'entrancescript' in loc)
+        # In the order of the location records.
+        self.directions = {}
+        for name, loc in data['locations'].items():
+            self.directions[name] = OrderedDict(
+                (d, dict((gc.PLAYER_COMMANDS[cmd.lower()],
+                          self.resolve('scripts', script))
+                         for cmd, script in loc['scripts'][d].items()))
+                for d in sorted(loc['scripts'],
+                                key=gc.DIRECTION_VALUES.get))
+        self.item_scripts = dict(
+            (name, dict((cmd, self.resolve('scripts', script))
+                        for cmd, script in item_d['scripts'].items()))
+            for name, item_d in data['items'].items())
+        self.initial_items = dict(
+            (name, self.location_name(item_d['location']))
+            for name, item_d in data['items'].items())
+        self.item_order = list(data['items'])
+        self.start_location = self.resolve('locations', start_location)
+        # When a dict, the indices of the commands run in each script.
+        self.coverage = None
+
+    def resolve(self, kind, name):
+        try:
+            return self.lookup[kind][name.lower()]
+        except KeyError:
+            raise ScriptError("undefined {} {}".format(kind[:-1], name))
+
+    def location_name(self, name):
+        if name in gc.CONSTANT_MAP:
+            return name
+        return self.resolve('locations', name)
+
+    def compile(self, name, cmds):
+        """
+        Check the commands of a script and resolve the names in them.
+        """
+        if not cmds or cmds[-1][0] not in ENDS:
+            raise ScriptError("script {} does not end".format(name))
+        res = []
+        for cmd in cmds:
+            op = cmd[0]
+            if op in (GOTO, GOEND, ISLOC):
+                cmd = (op, self.resolve('locations', cmd[1]))
+            elif op == SETITEMLOC:
+                cmd = (op, self.resolve('items', cmd[1]),
+                       self.location_name(cmd[2]))
+            elif op in (TEXT, TEXTEND):
+                cmd = (op, self.resolve('texts', cmd[1]))
+            elif op == IFTRUE:
+                cmd = (op, self.resolve('scripts', cmd[1]))
+            elif op in (SET, ISSTATE):
+                cmd = (op, int(cmd[1]), int(cmd[2]))
+            elif op in (TAKE, TAKEEND):
+                cmd = (op, self.resolve('items', cmd[1]))
+            elif op == ISOBJECT:
+                if cmd[1].lower() in self.lookup['items']:
+                    cmd = (op, (ITEM, self.resolve('items', cmd[1])))
+                else:
+                    cmd = (op, (DIRECTION, cmd[1].lower()))
+            res.append(cmd)
+        return res
+
+    def new_game(self, log_texts=True):
+        """
+        The state after GameInit and the entrance script of the start
+        location.
+        """
+        state = GameState(None, dict(self.initial_items),
+                          [0] * GAME_STATE_SIZE, [] if log_texts else None)
+        self.move(state, self.start_location, None)
+        return state
+
+    def move(self, state, location, target):
+        state.location = location
+        if location in self.entrance:
+            self.execute(state, self.entrance[location], target)
+
+    def run(self, state, script, target=None):
+        """
+        Run a script. target is the hotspot chosen for use, if any.
+        """
+        self.execute(state, self.resolve('scripts', script), target)
+
+    def execute(self, state, script, target):
+        cmds = self.scripts[script]
+        flags = state.flags
+        coverage = self.coverage
+        i = 0
+        while True:
+            if coverage is not None:
+                coverage.setdefault(script, set()).add(i)
+            cmd = cmds[i]
+            i += 1
+            op = cmd[0]
+            if op == ISSTATE:
+                flags[0] = 0
+                flags[0] = 1 if flags[cmd[1]] == cmd[2] else 0
+            elif op == IFTRUE:
+                if flags[0]:
+                    script = cmd[1]
+                    cmds = self.scripts[script]
+                    i = 0
+            elif op == TEXTEND:
+                if state.texts is not None:
+                    state.texts.append(cmd[1])
+                return
+            elif op == SET:
+                flags[cmd[1]] = cmd[2]
+            elif op == TEXT:
+                if state.texts is not None:
+                    state.texts.append(cmd[1])
+            elif op == SETITEMLOC:
+                state.items[cmd[1]] = cmd[2]
+            elif op == TAKE:
+                state.items[cmd[1]] = gc.TC_INVENTORY_LOC
+            elif op == TAKEEND:
+                state.items[cmd[1]] = gc.TC_INVENTORY_LOC
+                return
+            elif op == GOEND:
+                self.move(state, cmd[1], target)
+                return
+            elif op == GOTO:
+                self.move(state, cmd[1], target)
+            elif op == ISOBJECT:
+                flags[0] = 1 if target == cmd[1] else 0
+            elif op == ISLOC:
+                flags[0] = 1 if state.location == cmd[1] else 0
+            elif op == LOCATIONTEXTEND:
+                if state.texts is not None:
+                    state.texts.append(self.descriptions[state.location])
+                return
+            elif op in (WAITFORFIRE, SETTILE):
+                # Waits for the player; SETTILE is not implemented.
+                pass
+            else:
+                # END, or an unknown command.
+                return
+
+    def hotspots(self, state):
+        """
+        The hotspots listed at the player location: the directions, the
+        items there and the items in the inventory.
+        """
+        res = [(DIRECTION, d) for d in self.directions[state.location]]
+        for where in (state.location, gc.TC_INVENTORY_LOC):
+            res.extend((ITEM, item) for item in self.item_order
+                       if state.items[item] == where)
+        return res
+
+    def commands(self, state, hotspot):
+        """
+        The player commands of the hotspot, mapped to their scripts.
+        """
+        kind, name = hotspot
+        if kind == DIRECTION:
+            return self.directions[state.location].get(name, {})
+        return self.item_scripts[name]
+
+    def act(self, state, hotspot, command, target=None):
+        """
+        Run the command chosen for the hotspot, with the target hotspot
+        for use.
+        """
+        script = self.commands(state, hotspot).get(command)
+        if script is None:
+            raise ScriptError("no command {} for {}".format(command,
+                                                            hotspot))
+        if command == CMD_USE and target is None:
+            raise ScriptError("use needs a target")
+        self.execute(state, script, target)
+
+    def replay(self, actions, log_texts=True):
+        """
+        Play the actions, (hotspot, command, target) tuples, from the
+        start of a new game. Returns the final state.
+        """
+        state = self.new_game(log_texts)
+        for hotspot, command, target in actions:
+            self.act(state, hotspot, command, target)
+        return state
+
+
+def read_game(cfgfile):
+    """
+    Read the game data as generate_content.py writes it, with the
+    script and dead content passes set in [options].
+    """
+    cfg = ConfigParser()
+    cfg.optionxform = str
+    cfg.read(cfgfile)
+    data = gc.read_input(cfg)
+    gc.optimize_scripts(cfg, data)
+    gc.eliminate_dead_content(cfg, data)
+    return data
@@ -0,0 +1,125 @@
+"""
+Round-trip harness for the text compression.
+
+Encodes every displayed string of the game and a few synthetic corpora,
+decodes them again with the reference decoder and reports the throughput
+and the compression ratio. Fails loudly if any string does not survive
+the round trip.
+"""
+import argparse
+import os
+import random
+import time
+from configparser import ConfigParser
+
+import generate_content
+import huffmandecoder
+import huffmanencoder
+
+
+def roundtrip_corpus(name, strings, max_code_length=None):
+    """
+    Compress and decompress the strings; return the statistics.
+    """
+    encoded = [generate_content.encode_text(s) for s in strings]
+    n_symbols = sum(len(v) for v in encoded)
+
+    t0 = time.perf_counter()
+    dictionary = huffmanencoder.create_dictionary(
+        huffmanencoder.FrequencyCounter(encoded), max_code_length)
+    t1 = time.perf_counter()
+    arrays, offsets = huffmanencoder.create_compressed_arrays(dictionary,
+                                                              encoded)
+    t2 = time.perf_counter()
+
+    dictbytes = huffmanencoder.dictionary_to_bytes(dictionary)
+    blob = b"".join(arrays)
+    decoded = huffmandecoder.decompress_all(dictbytes, blob, offsets)
+    t3 = time.perf_counter()
+
+    for s, v, d in zip(strings, encoded, decoded):
+        if d != v:
+            raise AssertionError("Round trip failed in {}: {!r}".format(
+                name, s))
+
+    return {
+        'name': name,
+        'strings': len(strings),
+        'symbols': n_symbols,
+        'compressed_bytes': len(blob),
+        'dictionary_bytes': len(dictbytes),
+        'bits_per_symbol': 8.0 * len(blob) / n_symbols,
+        'longest_code': dictionary['max_code_length'],
+        'dictionary_seconds': t1 - t0,
+        'encode_symbols_per_second': n_symbols / max(t2 - t1, 1e-9),
+        'decode_symbols_per_second': n_symbols / max(t3 - t2, 1e-9),
+    }
+
+
+def synthetic_corpora(strings, scale=10, seed=0):
+    """
+    Create synthetic corpora from the game strings: word salad with the
+    same word frequencies, uniformly random characters and a single
+    repeated word.
+    """
+    rnd = random.Random(seed)
+    words = " ".join(strings).split()
+    chars = [c for c in generate_content.CODE_ALPHA if c != " "]
+    n_strings = len(strings) * scale
+
+    salad = []
+    for _ in range(n_strings):
+        salad.append(" ".join(rnd.choice(words)
+                              for _ in range(rnd.randint(1, 30))))
+
+    noise = []
+    for _ in range(n_strings):
+        noise.append("".join(rnd.choice(chars)
+                             for _ in range(rnd.randint(1, 120))))
+
+    repeated = ["penguin " * rnd.randint(1, 20) for _ in range(n_strings)]
+
+    return [("word salad x{}".format(scale), salad),
+            ("random characters x{}".format(scale), noise),
+            ("repeated word x{}".format(scale), repeated)]
+
+
+def print_report(stats):
+    print("{:<26} {:>7} {:>8} {:>8} {:>6} {:>5} {:>10} {:>10}".format(
+        "Corpus", "Strings", "Symbols", "Bytes", "Bits", "Max",
+        "Enc sym/s", "Dec sym/s"))
+    for st in stats:
+        print("{:<26} {:>7} {:>8} {:>8} {:>6.3f} {:>5} {:>10.0f} {:>10.0f}"
+              .format(st['name'], st['strings'], st['symbols'],
+                      st['compressed_bytes'], st['bits_per_symbol'],
+                      st['longest_code'], st['encode_symbols_per_second'],
+                      st['decode_symbols_per_second']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--cfg", default=os.path.join(
+        "..", "resources", "penguingamecontent.cfg"))
+    parser.add_argument("--max-code-length", type=int, default=None)
+    parser.add_argument("--scale", type=int, default=10,
+                        help="Size of the synthetic corpora relative to "
+                             "the game texts.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    cfg = ConfigParser()
+    cfg.optionxform = str
+    cfg.read(args.cfg)
+
+    strings = generate_content.extract_displayed_strings(
+        cfg, {'texts': cfg['text']})
+    corpora = [("game texts", strings)]
+    corpora.extend(synthetic_corpora(strings, args.scale, args.seed))
+
+    stats = [roundtrip_corpus(name, corpus, args.max_code_length)
+             for name, corpus in corpora]
+    print_report(stats)
+
+
+if __name__ == "__main__":
+    main()
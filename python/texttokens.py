@@ -0,0 +1,272 @@
+import math
+from collections import Counter
+
+import cyclemodel
+import huffmanencoder
+
+# Dictionary substitution for the encoded texts.
+#
+# Frequent sequences of text symbols are replaced with a single token
+# before the Huffman coding. The tokens are chosen greedily by merging the
+# most profitable pair of adjacent units at a time, so that common words
+# grow out of their digrams. DecodeText_HL2DE expands the tokens again
+# through the TEXT_TOKEN_TABLE.
+
+TOKEN_FIRST = 128
+MAX_TOKENS = 256 - TOKEN_FIRST
+
+CODE_TERMINATOR = 0
+CODE_UPPERCASE = 1
+CODE_NEWLINE = 2
+
+# Internal unit ids: plain symbols are themselves, an uppercase marker
+# with its letter is UPPERCASE_UNIT + letter, and merged pairs get ids from
+# MERGED_UNIT onwards.
+UPPERCASE_UNIT = 256
+MERGED_UNIT = 512
+
+
+def split_units(symbols):
+    """
+    Split the encoded symbols to units. An uppercase marker is kept
+    together with the letter it applies to, so that a token never starts
+    between them.
+    """
+    units = []
+    it = iter(symbols)
+    for c in it:
+        if c == CODE_UPPERCASE:
+            units.append(UPPERCASE_UNIT + next(it))
+        else:
+            units.append(c)
+    return units
+
+
+def unit_symbols(unit, expansions):
+    if unit < UPPERCASE_UNIT:
+        return (unit,)
+    elif unit < MERGED_UNIT:
+        return (CODE_UPPERCASE, unit - UPPERCASE_UNIT)
+    return expansions[unit]
+
+
+def unit_coded_symbols(unit):
+    """
+    The symbols that currently code the unit; a token is a single symbol.
+    """
+    if UPPERCASE_UNIT <= unit < MERGED_UNIT:
+        return (CODE_UPPERCASE, unit - UPPERCASE_UNIT)
+    return (unit,)
+
+
+def merge_pair(units, pair, new_unit):
+    """
+    Replace the non-overlapping occurrences of pair, from left to right.
+    """
+    a, b = pair
+    merged = []
+    i = 0
+    n = len(units)
+    while i < n:
+        if i + 1 < n and units[i] == a and units[i + 1] == b:
+            merged.append(new_unit)
+            i += 2
+        else:
+            merged.append(units[i])
+            i += 1
+    return merged
+
+
+def _strip_terminator(symbols):
+    if len(symbols) > 0 and symbols[-1] == CODE_TERMINATOR:
+        return symbols[:-1], True
+    return symbols, False
+
+
+def coded_counts(corpus, n_strings):
+    """
+    Count the symbols that code the corpus, with each merged unit taken
+    as a single token and one terminator per string.
+    """
+    counts = Counter()
+    for units in corpus:
+        counts.update(units)
+    for unit in [u for u in counts if UPPERCASE_UNIT <= u < MERGED_UNIT]:
+        c = counts.pop(unit)
+        counts[CODE_UPPERCASE] += c
+        counts[unit - UPPERCASE_UNIT] += c
+    counts[CODE_TERMINATOR] += n_strings
+    return counts
+
+
+def coded_size(corpus, expansions, max_code_length=None):
+    """
+    Size in bytes of the Huffman-coded corpus, its code tree and the
+    expansion table for the merged units in it.
+    """
+    counts = coded_counts(corpus, len(corpus))
+    frequencies = huffmanencoder.FrequencyCounter()
+    frequencies.counts = counts
+    dictionary = huffmanencoder.create_dictionary(frequencies,
+                                                  max_code_length)
+    lengths = dict((k, v[1]) for k, v in dictionary['code_table'].items())
+    end_length = lengths[dictionary['end_token']]
+    bits = sum(counts[k] * lengths[k] for k in counts)
+    # Each string ends with the end token and is padded to a full byte.
+    bits += len(corpus) * (end_length + 4)
+    table = sum(2 + len(expansions[u]) + 1 for u in counts
+                if u >= MERGED_UNIT)
+    return bits // 8 + len(dictionary['altdict']) + 1 + table
+
+
+def coded_cycles(corpus, expansions, max_code_length=None):
+    """
+    T-states to decode every string of the corpus once, by the cycle
+    model, with a dictionary oriented for speed.
+    """
+    counts = coded_counts(corpus, len(corpus))
+    frequencies = huffmanencoder.FrequencyCounter()
+    frequencies.counts = counts
+    frequencies.n_chunks = len(corpus)
+    dictionary = huffmanencoder.create_dictionary(
+        frequencies, max_code_length, prefer_zero_bits=True)
+    cycles = cyclemodel.code_cycles(dictionary)
+    tokens = dict((u, expansions[u]) for u in counts if u >= MERGED_UNIT)
+    total = 0
+    for units in corpus:
+        symbols = [c for u in units for c in unit_coded_symbols(u)]
+        symbols.append(CODE_TERMINATOR)
+        total += cyclemodel.text_cycles(dictionary, symbols, tokens,
+                                        cycles=cycles)[0]
+    return total
+
+
+def select_tokens(sequences, max_tokens=MAX_TOKENS, max_code_length=None,
+                  objective='size'):
+    """
+    Choose the tokens for the encoded sequences.
+
+    At each step, the pair of adjacent units with the best estimated
+    saving is merged: the bits of the two units, from their current
+    frequencies, minus the bits of the new token and the size of its
+    entry in the expansion table. The merges are kept up to the step that
+    gave the smallest coded size, or with the 'cycles' objective, the
+    fewest decoding T-states.
+    """
+    if max_tokens > MAX_TOKENS:
+        raise ValueError("At most {} tokens fit above code {}".format(
+            MAX_TOKENS, TOKEN_FIRST))
+    measure = coded_cycles if objective == 'cycles' else coded_size
+
+    initial = [split_units(_strip_terminator(s)[0]) for s in sequences]
+    corpus = initial
+    expansions = {}
+    merges = []
+    next_unit = MERGED_UNIT
+    best_size = measure(corpus, expansions, max_code_length)
+    best_merges = 0
+
+    while len(merges) < max_tokens:
+        counts = coded_counts(corpus, len(corpus))
+        total = sum(counts.values())
+        pair_counts = Counter()
+        for units in corpus:
+            pair_counts.update(zip(units, units[1:]))
+
+        def bits(unit):
+            return sum(math.log2(total / counts[k])
+                       for k in unit_coded_symbols(unit))
+
+        best = None
+        best_gain = 0
+        for pair, count in pair_counts.items():
+            if CODE_NEWLINE in pair:
+                continue
+            expansion = (unit_symbols(pair[0], expansions) +
+                         unit_symbols(pair[1], expansions))
+            # Pointer, expansion and terminator in the token table.
+            cost = 8 * (2 + len(expansion) + 1)
+            gain = (count * (bits(pair[0]) + bits(pair[1]) -
+                             math.log2(total / count)) - cost)
+            if gain > best_gain:
+                best = (pair, expansion)
+                best_gain = gain
+        if best is None:
+            break
+
+        pair, expansion = best
+        expansions[next_unit] = expansion
+        merges.append((pair, next_unit))
+        corpus = [merge_pair(units, pair, next_unit) for units in corpus]
+        next_unit += 1
+
+        size = measure(corpus, expansions, max_code_length)
+        if size < best_size:
+            best_size = size
+            best_merges = len(merges)
+
+    merges = merges[:best_merges]
+    corpus = initial
+    for pair, unit in merges:
+        corpus = [merge_pair(units, pair, unit) for units in corpus]
+
+    # Only the tokens left in the texts get a code; the rest were steps
+    # towards longer tokens.
+    used = set()
+    for units in corpus:
+        used.update(u for u in units if u >= MERGED_UNIT)
+    codes = {}
+    for _, unit in merges:
+        if unit in used:
+            codes[unit] = TOKEN_FIRST + len(codes)
+
+    return {
+        'merges': merges,
+        'expansions': expansions,
+        'codes': codes,
+        'table': [bytes(expansions[u]) for u in sorted(codes,
+                                                       key=codes.get)],
+    }
+
+
+def tokenize(symbols, tokens):
+    """
+    Replace the token sequences in the encoded symbols with their codes.
+    """
+    body, terminated = _strip_terminator(symbols)
+    units = split_units(body)
+    for pair, unit in tokens['merges']:
+        units = merge_pair(units, pair, unit)
+
+    output = bytearray()
+    codes = tokens['codes']
+    for u in units:
+        if u in codes:
+            output.append(codes[u])
+        else:
+            output.extend(unit_symbols(u, tokens['expansions']))
+    if terminated:
+        output.append(CODE_TERMINATOR)
+    return bytes(output)
+
+
+def expand(symbols, tokens):
+    """
+    Expand the token codes back to plain symbols, as the game does.
+    """
+    output = bytearray()
+    table = tokens['table']
+    for c in symbols:
+        if c >= TOKEN_FIRST:
+            output.extend(table[c - TOKEN_FIRST])
+        else:
+            output.append(c)
+    return bytes(output)
+
+
+def table_size(tokens):
+    """
+    Bytes taken by the expansion table: a pointer and a terminated
+    expansion per token.
+    """
+    return sum(2 + len(expansion) + 1 for expansion in tokens['table'])
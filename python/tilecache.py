@@ -0,0 +1,68 @@
+import hashlib
+import os
+import pickle
+
+import gfxconvert
+
+# On-disk cache of gfxconvert.convert_image() results.
+#
+# Each entry is keyed by a hash of the PNG bytes, the conversion
+# parameters and the sources of the conversion code, so a changed image,
+# setting or converter simply misses the cache.
+# The tiles are kept per image; merging them into the shared tile table
+# with gfxconvert.merge_charset() is cheap and gives the same keys as
+# converting the images in the same order.
+
+# Bump when the format of the cached results changes.
+CACHE_VERSION = 1
+
+# The modules whose code makes the cached results.
+SOURCES = (gfxconvert.__file__, __file__)
+
+
+def sources_hash():
+    h = hashlib.sha256()
+    for fname in SOURCES:
+        with open(fname, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def cache_key(data, params):
+    h = hashlib.sha256()
+    h.update(repr((CACHE_VERSION, sorted(params.items()))).encode("utf-8"))
+    h.update(sources_hash().encode("utf-8"))
+    h.update(data)
+    return h.hexdigest()
+
+
+def convert_image(imgname, cache_dir=None, verbose=True, **params):
+    """
+    As gfxconvert.convert_image(), but reuse an earlier result from
+    cache_dir if there is one. Without cache_dir, just convert.
+    """
+    if cache_dir is None:
+        return gfxconvert.convert_image(imgname, verbose=verbose, **params)
+
+    with open(imgname, "rb") as f:
+        data = f.read()
+    fname = os.path.join(cache_dir, cache_key(data, params) + ".pickle")
+    try:
+        with open(fname, "rb") as f:
+            result = pickle.load(f)
+        if verbose:
+            print("Tiles of", imgname, "from the cache.")
+        return result
+    except (OSError, EOFError, pickle.UnpicklingError):
+        pass
+
+    result = gfxconvert.convert_image(imgname, verbose=verbose, **params)
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write to a temporary name first, so an interrupted run does not
+    # leave a broken entry behind; processes converting the same image at
+    # once each use their own.
+    tmpname = "{}.{}.tmp".format(fname, os.getpid())
+    with open(tmpname, "wb") as f:
+        pickle.dump(result, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmpname, fname)
+    return result
@@ -0,0 +1,166 @@
+from collections import Counter
+
+import numpy as np
+from PIL import Image
+
+import gfxconvert
+
+# Lossy merging of near-duplicate location tiles.
+#
+# The distance between two tiles is the number of pixels that show a
+# different colour, i.e. the Hamming distance of their pattern bits taken
+# together with the colour of each row. A tile is replaced by a close
+# representative when the error it causes, counted in pixels over every
+# place the tile is drawn, fits in the budgets.
+
+# Bytes per tile in TILE_PATTERN_TABLE: 8 for the pattern, 1 for the colour.
+TILE_BYTES = 9
+
+
+def tile_indices(defined_chars):
+    """
+    Return the tile ids in order and their pixels as palette indices, an
+    array of 64 values per tile.
+    """
+    keys = sorted(defined_chars, key=defined_chars.get)
+    ids = [defined_chars[k] for k in keys]
+    return ids, gfxconvert.palette_indices(gfxconvert.tiles_array(keys))
+
+
+def pixel_distances(indices, chunk=256):
+    """
+    Count the differing pixels between every pair of tiles.
+    """
+    n = len(indices)
+    distances = np.zeros((n, n), dtype=np.uint8)
+    for i in range(0, n, chunk):
+        block = indices[i:i + chunk]
+        distances[i:i + chunk] = (block[:, None, :] !=
+                                  indices[None, :, :]).sum(axis=2)
+    return distances
+
+
+def merge_tiles(defined_chars, location_gfx, max_pixels, budget=None,
+                location_budget=None):
+    """
+    Choose the tiles to replace with a near-duplicate.
+
+    location_gfx maps each location to its tile ids. Pairs of tiles at most
+    max_pixels apart are taken cheapest first, the cost being the pixel
+    distance times the number of times the replaced tile is drawn; the
+    tile drawn less often is replaced. A tile that stands in for others is
+    not replaced itself, so every error is measured against the original.
+    budget bounds the total error and location_budget the error in any
+    one location.
+
+    Returns the replaced tiles, mapped to the tile that replaces them, and
+    the pixel error of each location.
+    """
+    ids, indices = tile_indices(defined_chars)
+    distances = pixel_distances(indices)
+
+    uses = dict((loc, Counter(gfx.values()))
+                for loc, gfx in location_gfx.items())
+    total_uses = Counter()
+    for c in uses.values():
+        total_uses.update(c)
+
+    candidates = []
+    close = np.argwhere((distances > 0) & (distances <= max_pixels))
+    for i, j in close:
+        if i >= j:
+            continue
+        a, b = ids[i], ids[j]
+        if (total_uses[a], -a) > (total_uses[b], -b):
+            a, b = b, a
+        d = int(distances[i, j])
+        candidates.append((d * total_uses[a], d, a, b))
+    candidates.sort()
+
+    replaced = {}
+    representatives = set()
+    errors = dict((loc, 0) for loc in location_gfx)
+    total_error = 0
+    for cost, d, a, b in candidates:
+        if a in replaced or a in representatives or b in replaced:
+            continue
+        if budget is not None and total_error + cost > budget:
+            continue
+        added = dict((loc, d * c[a]) for loc, c in uses.items() if a in c)
+        if location_budget is not None and any(
+                errors[loc] + e > location_budget
+                for loc, e in added.items()):
+            continue
+        replaced[a] = b
+        representatives.add(b)
+        total_error += cost
+        for loc, e in added.items():
+            errors[loc] += e
+    return replaced, errors
+
+
+def renumber(defined_chars, replaced):
+    """
+    Return the new id of every old id: the kept tiles are numbered in
+    their old order and a replaced tile takes the id of its replacement.
+    """
+    remap = {}
+    for t in sorted(defined_chars.values()):
+        if t not in replaced:
+            remap[t] = len(remap)
+    for a, b in replaced.items():
+        remap[a] = remap[b]
+    return remap
+
+
+def apply_merge(defined_chars, location_gfx, replaced):
+    """
+    Drop the replaced tiles from defined_chars and renumber the tiles and
+    the location graphics in place.
+    """
+    remap = renumber(defined_chars, replaced)
+    for k in list(defined_chars):
+        if defined_chars[k] in replaced:
+            del defined_chars[k]
+        else:
+            defined_chars[k] = remap[defined_chars[k]]
+    for gfx in location_gfx.values():
+        for pos in gfx:
+            gfx[pos] = remap[gfx[pos]]
+
+
+def render_location(gfx, pixels):
+    """
+    Draw a location from its tile ids; pixels maps the ids to 8x8 arrays.
+    """
+    sample = next(iter(pixels.values()))
+    w = int(max(x for x, _ in gfx)) + 1
+    h = int(max(y for _, y in gfx)) + 1
+    img = np.zeros((h * 8, w * 8) + sample.shape[2:], dtype=sample.dtype)
+    for (x, y), t in gfx.items():
+        x, y = int(x), int(y)
+        img[y * 8:(y + 1) * 8, x * 8:(x + 1) * 8] = pixels[t]
+    return img
+
+
+def write_preview(fname, defined_chars, location_gfx, replaced, scale=2):
+    """
+    Write a PNG with each location before (left) and after (right) the
+    merge, one location per row. Call before apply_merge().
+    """
+    pixels = dict((v, np.array(k).reshape((8, 8, -1)))
+                  for k, v in defined_chars.items())
+    merged = dict((t, pixels[replaced.get(t, t)]) for t in pixels)
+    rows = []
+    for gfx in location_gfx.values():
+        before = render_location(gfx, pixels)
+        after = render_location(gfx, merged)
+        gap = np.zeros((before.shape[0], 8) + before.shape[2:],
+                       dtype=before.dtype)
+        rows.append(np.concatenate([before, gap, after], axis=1))
+        rows.append(np.zeros((8,) + rows[-1].shape[1:], dtype=before.dtype))
+    img = np.concatenate(rows[:-1], axis=0).astype(np.uint8)
+    preview = Image.fromarray(img, "RGBA" if img.shape[2] == 4 else "RGB")
+    preview = preview.resize((preview.width * scale,
+                              preview.height * scale), Image.NEAREST)
+    preview.save(fname)
@@ -0,0 +1,98 @@
+from collections import OrderedDict
+
+# Ordering of the global tile ids.
+#
+# Each location palette lists the tiles of the location as runs of
+# consecutive global ids, [skip][length] for each run and $ff at the end,
+# with an extra [254][0] for every 254 ids skipped beyond the first 254
+# (see Palette.encode() in generate_content.py). The tiles used by the
+# same set of locations are kept together, and the order of these groups
+# is improved by moving one group at a time to where it shortens the
+# palettes most.
+
+MAX_SKIP = 254
+
+
+def tile_groups(location_gfx):
+    """
+    Group the tile ids used in the locations by the set of locations that
+    use them. Returns the sets mapped to their tile ids, ordered by the
+    first id of each group.
+    """
+    users = {}
+    for loc, gfx in location_gfx.items():
+        for t in set(gfx.values()):
+            users.setdefault(t, set()).add(loc)
+    groups = OrderedDict()
+    for t in sorted(users):
+        groups.setdefault(frozenset(users[t]), []).append(t)
+    return groups
+
+
+def palette_bytes(order, groups, n_locations):
+    """
+    The total size of the location palettes with the groups laid out in
+    the given order.
+    """
+    total = n_locations
+    prev_end = {}
+    pos = 0
+    for group in order:
+        n = len(groups[group])
+        for loc in group:
+            end = prev_end.get(loc)
+            if end != pos - 1:
+                skipped = pos - (-1 if end is None else end) - 1
+                total += 2 + 2 * max(0, (skipped - 1) // MAX_SKIP)
+            prev_end[loc] = pos + n - 1
+        pos += n
+    return total
+
+
+def order_groups(groups, n_locations, max_sweeps=20):
+    """
+    Order the groups for small palettes: starting from their first-seen
+    order, move each group in turn to the place where the palettes are
+    smallest, until a sweep over all groups changes nothing.
+    """
+    order = list(groups)
+    best = palette_bytes(order, groups, n_locations)
+    for _ in range(max_sweeps):
+        improved = False
+        for group in list(order):
+            rest = [g for g in order if g != group]
+            for i in range(len(rest) + 1):
+                candidate = rest[:i] + [group] + rest[i:]
+                size = palette_bytes(candidate, groups, n_locations)
+                if size < best:
+                    best = size
+                    order = candidate
+                    improved = True
+        if not improved:
+            break
+    return order
+
+
+def reorder_tiles(defined_chars, location_gfx, max_sweeps=20):
+    """
+    Renumber the tiles in defined_chars and the location graphics in place
+    so that the location palettes are small. Tiles no location uses go
+    last. Returns the new id of every old id.
+    """
+    groups = tile_groups(location_gfx)
+    order = order_groups(groups, len(location_gfx), max_sweeps)
+
+    remap = {}
+    for group in order:
+        for t in groups[group]:
+            remap[t] = len(remap)
+    for t in sorted(defined_chars.values()):
+        if t not in remap:
+            remap[t] = len(remap)
+
+    for k in defined_chars:
+        defined_chars[k] = remap[defined_chars[k]]
+    for gfx in location_gfx.values():
+        for pos in gfx:
+            gfx[pos] = remap[gfx[pos]]
+    return remap
@@ -232,13 +232,13 @@ LoadMainGraphics:
 	
 	ld de, UIGFX_COLOUR_RLE
 	ld hl, LEN_BASECHARS * 8 + $2000
-	call LoadRLE2VRAM
+	call Unpack2VRAM
 	ld de, UIGFX_COLOUR_RLE
 	ld hl, LEN_BASECHARS * 8 + $2800
-	call LoadRLE2VRAM
+	call Unpack2VRAM
 	ld de, UIGFX_COLOUR_RLE
 	ld hl, LEN_BASECHARS * 8 + $3000
-	call LoadRLE2VRAM
+	call Unpack2VRAM
 	
 	call ClearUI
 	ret
@@ -313,12 +313,33 @@ Decompress:
 	ret	
 
 	
+SelectTextDictionary:
+	;; IY = pointer to compressed text location.
+	;; Sets IX to the dictionary of the text. With more than one
+	;; dictionary, the first byte of the text selects it.
+	ld ix, TEXT_HUFFDICT
+	ld a, C_TEXT_DICTIONARIES
+	cp 2
+	ret c
+	ld a, (iy)
+	inc iy
+	add a, a
+	ld l, a
+	ld h, 0
+	ld de, TEXT_HUFFDICT_TABLE
+	add hl, de
+	call UnrefHL
+	push hl
+	pop ix
+	ret
+
+
 GetTextToBuffer:
 	;; IY = pointer to compressed text location.
 	
 	call ClearTextbox
 	;; First, unpack text to TEXT_BUFFER.
-	ld ix, TEXT_HUFFDICT
+	call SelectTextDictionary
 	ld hl, TEXT_BUFFER
 	call Decompress
 	ld hl, TEXT_BUFFER
@@ -330,7 +351,7 @@ GetTextToBuffer:
 GetTextToLineBuffer:
 	;call ClearTextbox
 	;; First, unpack text to TEXT_BUFFER.
-	ld ix, TEXT_HUFFDICT
+	call SelectTextDictionary
 	ld hl, TEXT_BUFFER
 	call Decompress
 	ld hl, TEXT_BUFFER
@@ -348,8 +369,13 @@ GetTextToLineBuffer:
 
 	
 ;; Read unpacked, encoded data from a memory address until terminator (0).
-;; Encoding: byte 1 means the next letter is in upper case.
+;; Encoding: byte 1 means the next letter is in upper case, byte 2 moves
+;; to the start of the next line of the text window. C counts the column;
+;; with newlines, every line up to the last ends in one, full lines too,
+;; so C never goes past C_TEXT_LINE_LENGTH.
 DecodeText_HL2DE:
+		ld c, 0
+	.expand:
 		ld b, 0
 	.loopStart:
 		ld a, (hl)
@@ -358,16 +384,52 @@ DecodeText_HL2DE:
 		jp z, .uppercase
 		cp 0  ;; Signals termination
 		ret z
-		cp 2 ;; Signals end-of-line, not implemented
+		cp 2 ;; Signals end-of-line
+		jp z, .newline
+		cp C_TEXT_TOKEN_FIRST ;; Signals a token to expand
+		jp nc, .token
 	.addOffset:
 		add a, b
 		ld b, 0
 		ld (de), a 
 		inc de
+		inc c
 		jp .loopStart
 	.uppercase:
 		ld b, 26
 		jp .loopStart
+	.newline:
+		;; Skip the rest of the line; the window is already cleared.
+		ld a, C_TEXT_LINE_LENGTH
+		sub c
+		add a, e
+		ld e, a
+		adc a, d
+		sub e
+		ld d, a
+		ld c, 0
+		jp .loopStart
+	.token:
+		;; Decode the expansion of the token from TEXT_TOKEN_TABLE.
+		;; Expansions hold no tokens, so this recurses only once.
+		;; The column carries on through the expansion.
+		push hl
+		push bc
+		sub C_TEXT_TOKEN_FIRST
+		ld l, a
+		ld h, 0
+		add hl, hl
+		ld bc, TEXT_TOKEN_TABLE
+		add hl, bc
+		call UnrefHL
+		pop bc
+		push bc
+		call .expand
+		ld a, c
+		pop bc
+		ld c, a
+		pop hl
+		jp .loopStart
 
 
 ;; CORE GAME LOOP
@@ -1416,18 +1478,18 @@ TitleScreen:
 		;; 3. Unpack RLE
 		ld de, UIGFX_TITLESCREEN_RLE
 		ld hl, $1800
-		call LoadRLE2VRAM
+		call Unpack2VRAM
 		;; 4. Unpack colour RLE.
 		call WaitForBlank
 		ld de, UIGFX_TITLESCREEN_CRLE
 		ld hl, $2000
-		call LoadRLE2VRAM
+		call Unpack2VRAM
 		ld de, UIGFX_TITLESCREEN_CRLE
 		ld hl, $2800
-		call LoadRLE2VRAM
+		call Unpack2VRAM
 		ld de, UIGFX_TITLESCREEN_CRLE
 		ld hl, $3000
-		call LoadRLE2VRAM
+		call Unpack2VRAM
 		
 	.loop:
 		call CheckControls
@@ -1445,30 +1507,17 @@ DIRECTIONS: ;; Set of Huffman-encoded strings
 		INCLUDE "pregen/commands.asm_pregen"
 TEXT_HUFFDICT:
 		INCBIN "incbins/textdictionary.huffarc"
+		INCLUDE "pregen/texttokens.asm_pregen"
+		INCLUDE "pregen/huffdicts.asm_pregen"
 
 SPRITE_GFX:
 		INCBIN "incbins/gfx_sprites.bin"
 		
 end_permanentData:
 
-LOCATION_RECORDS:
-		INCLUDE "pregen/locations.asm_pregen"
-
-PALETTES:
-		INCLUDE "pregen/palette.asm_pregen"
-
-GFXVIEWS:
-        INCLUDE "pregen/gfxview.asm_pregen"
-
-TEXTS:
-		INCLUDE "pregen/texts.asm_pregen"
-
-TILEGFX:
-		INCLUDE "pregen/tilegfx.asm_pregen"
-		
-		INCLUDE "pregen/items_rom.asm_pregen"
-	
-		INCLUDE "pregen/scripts.asm_pregen"		
+;; Locations, palettes, graphics views, texts, tiles, items and scripts,
+;; as sources or as one binary; see data_backend in the content config.
+		INCLUDE "pregen/data.asm_pregen"
 
 
 
@@ -1528,6 +1577,11 @@ CHAR_UPPER_A: EQU 29
 
 C_VISIBLE_LIST_LENGTH: EQU 13 
 
+;; Codecs of the streams unpacked by Unpack2VRAM; see screencodecs.py.
+C_CODEC_RLE: EQU 0
+C_CODEC_LITERAL_RLE: EQU 1
+C_CODEC_LZ: EQU 2
+
 C_ITEM_LOCAL_ICON: EQU 89
 C_ITEM_INVENTORY_ICON: EQU 88
 C_ITEM_DIRECTION: EQU 85
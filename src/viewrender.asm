@@ -272,9 +272,107 @@ LoadRLE2VRAM:
 	add hl, bc
 	jp .loop
 
+Unpack2VRAM:
+	;; Unpack a stream to VRAM at HL. DE points to the stream, which
+	;; starts with a byte naming the codec.
+	ld a, (de)
+	inc de
+	cp C_CODEC_LITERAL_RLE
+	jp z, LoadLiteralRLE2VRAM
+	cp C_CODEC_LZ
+	jp z, LoadLZ2VRAM
+	jp LoadRLE2VRAM
+
+LoadLiteralRLE2VRAM:
+	;; Unpack RLE with literal runs to VRAM.
+	;; [n][value] for n = 1..127 fills n bytes;
+	;; [128 + n - 1][n bytes] copies n bytes; ends when n=0.
+  .loop:
+	ld a, (de)
+	inc de
+	and a
+	ret z
+	bit 7, a
+	jp nz, .literals
+	ld c, a
+	ld b, 0
+	ld a, (de) ;; Value.
+	inc de
+	push de
+	push bc
+	push hl
+	call FILVRM
+	pop hl
+	pop bc
+	pop de
+	add hl, bc
+	jp .loop
+  .literals:
+	and $7f
+	inc a
+	call CopyLiterals2VRAM
+	jp .loop
+
+LoadLZ2VRAM:
+	;; Unpack LZ-coded data to VRAM.
+	;; [n][n bytes] for n = 1..127 copies n bytes;
+	;; [128 + n - 3][distance - 1] copies n bytes from distance bytes
+	;; back in VRAM; ends when n=0.
+  .loop:
+	ld a, (de)
+	inc de
+	and a
+	ret z
+	bit 7, a
+	jp nz, .match
+	call CopyLiterals2VRAM
+	jp .loop
+  .match:
+	sub 128 - 3
+	ld b, a ;; Bytes to copy.
+	ld a, (de) ;; Distance - 1.
+	inc de
+	push de
+	ld e, a
+	ld d, 0
+	inc de
+	push hl
+	and a
+	sbc hl, de ;; Where to copy from.
+	pop de ;; Where to copy to.
+  .copy:
+	call RDVRM
+	ex de, hl
+	call WRTVRM
+	ex de, hl
+	inc hl
+	inc de
+	djnz .copy
+	ex de, hl
+	pop de
+	jp .loop
+
+CopyLiterals2VRAM:
+	;; Copy A bytes from DE to VRAM at HL; DE and HL are moved past them.
+	ld c, a
+	ld b, 0
+	push hl
+	push de
+	push bc
+	ex de, hl
+	call LDIRVM
+	pop bc
+	pop de
+	pop hl
+	add hl, bc
+	ex de, hl
+	add hl, bc
+	ex de, hl
+	ret
+
 ClearUI:
 	ld de, UIGFX_EMPTY_SCREEN_RLE
 	ld hl, $1800
-	call LoadRLE2VRAM
+	call Unpack2VRAM
 	ret	
 		
\ No newline at end of file